@@ -4,22 +4,10 @@ import os
 import sys
 from enum import Enum
 
-import torch
 from dotenv import load_dotenv
-from transformers import (
-    AutoModel,
-    AutoModelForCausalLM,
-    AutoTokenizer,
-    BitsAndBytesConfig,
-    logging,
-)
-
-from crawler.rss_crawler import import_data
-from rag.processor import process
 
 # override=True if needed
 load_dotenv()
-logging.set_verbosity_error()
 # Получаем текущую рабочую директорию (PWD) и добавляем /src
 project_src_path = os.path.join(os.getcwd(), "src")
 
@@ -27,16 +15,45 @@ project_src_path = os.path.join(os.getcwd(), "src")
 sys.path.insert(0, project_src_path)
 
 
-def run_async_function(args, tokenizer, embedding_model, device, model=None):
-    if model:
-        asyncio.run(args.func(args, tokenizer, embedding_model, device, model))
-    else:
-        asyncio.run(args.func(args, tokenizer, embedding_model, device))
+# модули команд импортируются только при запуске команды,
+# а модели загружаются реестром `models.models` при первом обращении
+def import_data(args):
+    from crawler.rss_crawler import import_data
+
+    return import_data(args)
+
+
+def process(args):
+    from rag.processor import process
+
+    return process(args)
+
+
+def reembed(args):
+    from crawler.reembed import reembed
+
+    return reembed(args)
+
+
+def worker(args):
+    from backend.job.worker import JobWorker
+
+    return JobWorker(worker_id=args.worker_id, kinds=args.kinds).run()
+
+
+def scheduler(args):
+    from backend.job.scheduler import Scheduler
+
+    kwargs = {"workers": args.workers, "tick_seconds": args.tick}
+    return Scheduler(**{k: v for k, v in kwargs.items() if v is not None}).run()
 
 
 class Command(Enum):
     IMPORT_DATA = "import-data"
     PROCESS_DATA = "process-data"
+    REEMBED = "reembed"
+    WORKER = "worker"
+    SCHEDULER = "scheduler"
 
 
 def main():
@@ -75,43 +92,73 @@ def main():
     )
     process_parser.set_defaults(func=process)
 
+    # reembed command
+    reembed_parser = subparsers.add_parser(
+        Command.REEMBED.value,
+        help="Recompute stored embeddings with the configured embedding model",
+    )
+    reembed_parser.add_argument(
+        "--tables",
+        nargs="+",
+        choices=["articles", "documents"],
+        help="Tables to re-embed, all by default",
+        required=False,
+    )
+    reembed_parser.add_argument(
+        "--page-size",
+        type=int,
+        help="Number of rows embedded and written at once",
+        required=False,
+    )
+    reembed_parser.add_argument(
+        "--only-missing",
+        action="store_true",
+        help="Embed only rows without embeddings",
+    )
+    reembed_parser.set_defaults(func=reembed)
+
+    # worker command
+    worker_parser = subparsers.add_parser(
+        Command.WORKER.value, help="Run jobs from the queue until stopped"
+    )
+    worker_parser.add_argument(
+        "--kinds",
+        nargs="+",
+        choices=["analysis", "feed", "document"],
+        help="Kinds of jobs to run, all by default",
+        required=False,
+    )
+    worker_parser.add_argument(
+        "--worker-id",
+        type=str,
+        help="Unique worker name, host:pid by default",
+        required=False,
+    )
+    worker_parser.set_defaults(func=worker)
+
+    # scheduler command
+    scheduler_parser = subparsers.add_parser(
+        Command.SCHEDULER.value,
+        help="Schedule monitoring analyses and run a pool of worker processes",
+    )
+    scheduler_parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes, SCHEDULER_WORKERS by default",
+        required=False,
+    )
+    scheduler_parser.add_argument(
+        "--tick",
+        type=float,
+        help="Seconds between scheduling rounds, SCHEDULER_TICK_SECONDS by default",
+        required=False,
+    )
+    scheduler_parser.set_defaults(func=scheduler)
+
     args = parser.parse_args()
     print(args)
     if hasattr(args, "func"):
-        if torch.cuda.is_available():
-            device = "cuda"
-            bnb_config = BitsAndBytesConfig(
-                load_in_4bit=True,
-                bnb_4bit_use_double_quant=True,
-                bnb_4bit_quant_type="nf4",
-                bnb_4bit_compute_dtype=torch.bfloat16,
-            )
-        else:
-            device = "cpu"
-            bnb_config = None
-
-        tokenizer = AutoTokenizer.from_pretrained(
-            os.getenv("LLM_MODEL_NAME"),
-            token=os.getenv("HF_TOKEN"),
-        )
-        embedding_model = AutoModel.from_pretrained(
-            os.getenv("EMBEDDING_MODEL_NAME"),
-            token=os.getenv("HF_TOKEN"),
-        )
-        embedding_model.resize_token_embeddings(len(tokenizer))
-        if args.command == "import-data":
-            run_async_function(args, tokenizer, embedding_model, device)
-        elif args.command == "process-data":
-            model = AutoModelForCausalLM.from_pretrained(
-                os.getenv("LLM_MODEL_NAME"),
-                token=os.getenv("HF_TOKEN"),
-                quantization_config=bnb_config,
-                device_map=device,
-                torch_dtype=torch.bfloat16,
-            )
-            run_async_function(args, tokenizer, model, embedding_model, device)
-        else:
-            print("Hello! This is a data classification program!")
+        asyncio.run(args.func(args))
     else:
         print("Invalid command. Use '--help' for assistance.")
 
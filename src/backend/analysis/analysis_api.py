@@ -1,29 +1,28 @@
+import asyncio
+import json
+import os
 import re
 from datetime import datetime, timedelta
 
-import pandas as pd
-from fastapi import APIRouter, Depends, Request
+from dotenv import load_dotenv
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 
-# from models.models import device, load_embedding_model, load_tokenizer
 from backend.analysis.analysis_dao import AnalysesDAO
 from backend.auth.auth_api import get_current_user
-from backend.document.document_api import process
-from backend.document.document_dao import DocumentsDAO
+from backend.dao.llm_conn_dao import LLMConnectionsDAO, results_listener
 from backend.feed.feed_dao import FeedsDAO
-from crawler.processor import get_embeddings
-from crawler.scraper.scraper.spiders.doc_crawler import import_data
-from utils import split_text_into_paragraphs, write_request
+from backend.job.job_dao import JobsDAO
+from backend.job.scheduler import enqueue_analysis_run
 
+load_dotenv()
 
-def load_embedding_model():
-    pass
-
-
-def load_tokenizer():
-    pass
-
-
-device = "CUDA"
+# как часто поток статуса задачи перечитывает её из БД
+JOB_STREAM_POLL_SECONDS = float(os.getenv("JOB_STREAM_POLL_SECONDS", 1))
+MONITORING_INTERVAL_HOURS = float(os.getenv("MONITORING_INTERVAL_HOURS", 24))
+# комментарий в потоке результатов, чтобы прокси не закрывали соединение
+RESULTS_KEEPALIVE_SECONDS = float(os.getenv("RESULTS_KEEPALIVE_SECONDS", 15))
+RESULTS_PAGE_SIZE = 100
 
 
 def examples_formatting(examples: str, categories):
@@ -54,11 +53,7 @@ router = APIRouter(prefix="/analysis", tags=["Analysis"])
 
 
 @router.post("/create")
-async def create_new_analysis(
-    request: Request,
-    tokenizer=Depends(load_tokenizer),
-    embedding_model=Depends(load_embedding_model),
-):
+async def create_new_analysis(request: Request):
     data = await request.json()
     name: str = data["name"]
     categories: str = data["categories"]
@@ -68,11 +63,21 @@ async def create_new_analysis(
     description: str = data.get("description")
     examples: str = data.get("examples")
     urls: str = data.get("urls")
-    urls_list = urls.split()
+    urls_list = (urls or "").split()
     document: str = data.get("docs")
 
     user = await get_current_user(request)
 
+    # проверки до записи фидов и анализа, чтобы не оставлять их без задач
+    if analysis_type == "monitoring" and (source_type != "links" or not urls_list):
+        raise HTTPException(status_code=400, detail="Monitoring needs feed links")
+    if analysis_type == "single" and source_type == "links" and len(urls_list) > 1:
+        return {"error": "Too many links"}
+    if analysis_type == "single" and source_type == "links" and not urls_list:
+        raise HTTPException(status_code=400, detail="No link to analyse")
+    if analysis_type == "single" and source_type != "links" and not document:
+        raise HTTPException(status_code=400, detail="No document to analyse")
+
     # async def process_sources():
     # обработка фидов запускается по расписанию планировщиком
     if source_type == "links" and analysis_type == "monitoring":
@@ -87,23 +92,6 @@ async def create_new_analysis(
             else:
                 feed_obj = await feed_dao.add(url=url)
 
-    # загрузка документов в БД
-    if analysis_type == "single":
-        if source_type == "links" and len(urls_list) == 1:
-            # пока обрабатваем только первую ссылку
-            document = import_data(urls_list[0])[0]
-
-        document_obj = await DocumentsDAO.add(
-            url=url,
-            title=split_text_into_paragraphs(document, 50),
-            description=split_text_into_paragraphs(document, 300),
-            content=document,
-            embeddings=get_embeddings(
-                tokenizer, embedding_model, device, pd.DataFrame(document)
-            )[0],
-        )
-        if len(urls_list) > 1:
-            return {"error": "Too many links"}
     formated_examples = examples_formatting(examples, categories) if examples else None
 
     # создаение анализа
@@ -116,18 +104,82 @@ async def create_new_analysis(
         description=description,
     )
 
-    # сразу обрабатваем только тексты до 2500 символов (в среднем одна страница формата A4 и 1000 токенов)
-    if analysis_type == "single" and len(document) < 2500:
-        await process(document_obj.document_id, analysis_obj.analysis_id)
-
-    # записывам запрос в csv файл для последующего запуска обработки
+    # скрапинг, эмбеддинги и генерация идут в воркерах (`app.py worker`),
+    # клиент сразу получает id задачи и следит за ней через /analysis/jobs/{id}
     if analysis_type == "monitoring":
-        request = [analysis_obj.analysis_id, feed_obj.feed_id, ""]
-    else:
-        request = [analysis_obj.analysis_id, "", document_obj.document_id]
+        # первый запуск как у планировщика: загрузка всех фидов, затем обработка
+        jobs = await enqueue_analysis_run(analysis_obj.request_id, user.user_id)
+        # следующий запуск планировщик поставит через интервал
+        await AnalysesDAO.mark_run([analysis_obj.request_id])
+        return {
+            "job_id": jobs[0].job_id if jobs else None,
+            "job_ids": [job.job_id for job in jobs],
+            "analysis_id": analysis_obj.request_id,
+        }
+
+    # пользователь ждёт результат разового анализа, он идёт раньше мониторинга
+    job = await JobsDAO.enqueue(
+        "document",
+        {
+            "req_id": analysis_obj.request_id,
+            "user_id": user.user_id,
+            "url": urls_list[0] if source_type == "links" and urls_list else None,
+            "text": document if source_type != "links" else None,
+        },
+        priority=10,
+    )
+    return {"job_id": job.job_id, "analysis_id": analysis_obj.request_id}
+
 
-    write_request(request)
-    # return StreamingResponse(process_sources, media_type="application/x-ndjson")
+def job_status(job) -> dict:
+    return {
+        "id": job.job_id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress or {},
+        "attempts": job.attempts,
+        "error": job.last_error,
+        "result": job.result,
+        "updatedAt": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+async def find_user_job(request: Request, job_id: int):
+    user = await get_current_user(request)
+    job = await JobsDAO.find_one_or_none_by_id(job_id)
+    if not job or (job.payload or {}).get("user_id") != user.user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int, request: Request):
+    return job_status(await find_user_job(request, job_id))
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: int, request: Request):
+    """Streams job status as NDJSON: a line on every change of status or
+    progress, the stream ends when the job is done or dead"""
+    job = await find_user_job(request, job_id)
+
+    async def events():
+        last = None
+        current = job
+        while True:
+            status = job_status(current)
+            if status != last:
+                yield json.dumps(status, ensure_ascii=False) + "\n"
+                last = status
+            if current.status in ("done", "dead") or await request.is_disconnected():
+                return
+            await asyncio.sleep(JOB_STREAM_POLL_SECONDS)
+            current = await JobsDAO.find_one_or_none_by_id(job_id)
+            if current is None:
+                # задачу удалили, пока клиент следил за ней
+                return
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 
 @router.get("/templates")
@@ -152,7 +204,7 @@ async def get_templates(request: Request):
 @router.get("/monitoring")
 async def get_monitoring(request: Request):
     user = await get_current_user(request)
-    analyses = AnalysesDAO().find_all(user_id=user.id)
+    analyses = await AnalysesDAO.find_all(user_id=user.user_id)
     yesterday = datetime.now().replace(
         hour=0, minute=0, second=0, microsecond=0
     ) - timedelta(days=1)
@@ -161,8 +213,11 @@ async def get_monitoring(request: Request):
     for analysis in analyses:
         conns = analysis.llm_conns
 
-        # Безопасное получение последнего created_at (если conns не пуст)
-        last_run = conns[-1].created_at.strftime("%d.%m.%Y") if conns else ""
+        # время запуска ставит планировщик, следующий запуск через интервал
+        last_run = analysis.last_run_at
+        next_run = (
+            last_run + timedelta(hours=MONITORING_INTERVAL_HOURS) if last_run else None
+        )
 
         # Считаем новые источники (за последние сутки)
         new_sources = (
@@ -177,9 +232,9 @@ async def get_monitoring(request: Request):
                 "name": analysis.name,
                 "description": analysis.description,
                 "status": analysis.is_active,
-                "frequency": "Daily",
-                "lastRun": last_run,
-                "nextRun": last_run + timedelta(days=1) if last_run else "",
+                "frequency": f"Every {MONITORING_INTERVAL_HOURS:g} h",
+                "lastRun": last_run.strftime("%d.%m.%Y %H:%M") if last_run else "",
+                "nextRun": next_run.strftime("%d.%m.%Y %H:%M") if next_run else "",
                 "sources": len(conns),
                 "newSources": new_sources,
             }
@@ -190,3 +245,67 @@ async def get_monitoring(request: Request):
 
 # @router.get("/results")
 # async def results(analysis_id)
+
+
+def result_event(row) -> str:
+    data = {
+        "id": row.conn_id,
+        "seq": row.seq,
+        "articleId": row.article_id,
+        "documentId": row.document_id,
+        "title": row.title,
+        "link": row.link,
+        "response": row.response,
+        "createdAt": row.created_at.isoformat() if row.created_at else None,
+    }
+    return (
+        f"id: {row.seq}\nevent: result\n"
+        f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    )
+
+
+@router.get("/{analysis_id}/results/stream")
+async def stream_results(analysis_id: int, request: Request, after: int = 0):
+    """Streams answers of the analysis as server-sent events: stored answers
+    after the `after` seq first, then new ones as soon as they are committed.
+    The event id is the seq of the answer, which grows in commit order, so a
+    reconnecting EventSource resumes from Last-Event-ID without gaps"""
+    user = await get_current_user(request)
+    analysis = await AnalysesDAO.find_one_or_none_by_id(analysis_id)
+    if not analysis or analysis.user_id != user.user_id:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def events():
+        cursor = after
+        # подписка раньше чтения сохранённых ответов, чтобы не пропустить новые
+        async with results_listener.subscribe(analysis_id) as queue:
+            while not await request.is_disconnected():
+                rows = await LLMConnectionsDAO.find_results(
+                    analysis_id, after_seq=cursor, limit=RESULTS_PAGE_SIZE
+                )
+                for row in rows:
+                    cursor = row.seq
+                    yield result_event(row)
+                if len(rows) == RESULTS_PAGE_SIZE:
+                    continue
+                # ждём пачку новее курсора; None -- слушатель переподключился
+                # и уведомления могли потеряться, перечитываем из БД
+                while not await request.is_disconnected():
+                    try:
+                        seq = await asyncio.wait_for(
+                            queue.get(), RESULTS_KEEPALIVE_SECONDS
+                        )
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                    if seq is None or seq > cursor:
+                        break
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
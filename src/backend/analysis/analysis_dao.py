@@ -1,6 +1,53 @@
+from database.database import async_session_maker
+from sqlalchemy import func, or_, select, update
+
 from backend.dao.base import BaseDAO
 from backend.database.models import AnalysisRequest
 
 
 class AnalysesDAO(BaseDAO):
     model = AnalysisRequest
+
+    @classmethod
+    async def find_due_monitoring(cls, interval_hours: float, limit: int = 100):
+        """Active monitoring analyses that were not run for interval_hours,
+        the longest waiting first
+
+        Returns:
+            list: rows with request_id and user_id
+        """
+        async with async_session_maker() as session:
+            stmt = (
+                select(cls.model.request_id, cls.model.user_id)
+                .where(
+                    cls.model.is_active,
+                    cls.model.analysis_type == "monitoring",
+                    or_(
+                        cls.model.last_run_at.is_(None),
+                        cls.model.last_run_at
+                        <= func.now()
+                        - func.make_interval(0, 0, 0, 0, 0, 0, interval_hours * 3600),
+                    ),
+                )
+                .order_by(cls.model.last_run_at.asc().nulls_first())
+                .limit(limit)
+            )
+            result = await session.execute(stmt)
+            return result.all()
+
+    @classmethod
+    async def mark_run(cls, request_ids: list[int]):
+        if not request_ids:
+            return
+        async with async_session_maker() as session:
+            stmt = (
+                update(cls.model)
+                .where(cls.model.request_id.in_(request_ids))
+                .values(last_run_at=func.now())
+            )
+            try:
+                await session.execute(stmt)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Analysis update failed: {str(e)}")
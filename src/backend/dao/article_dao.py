@@ -1,21 +1,50 @@
-import select
+import os
 
+import numpy as np
 from database.database import async_session_maker
-from sqlalchemy import exists
-from sqlalchemy.dialects.postgresql import insert
+from dotenv import load_dotenv
+from pgvector.asyncpg import register_vector
+from sqlalchemy import Integer, String, exists, func, select, text
+from sqlalchemy.dialects.postgresql import JSONB
 
 from backend.dao.base import BaseDAO
 from backend.database.models import AnalysisRequest, Article, LLMConnection
 
+load_dotenv()
+
+# во сколько раз кандидатов из векторного индекса больше, чем нужно строк
+ANN_CANDIDATES_FACTOR = int(os.getenv("ANN_CANDIDATES_FACTOR", 10))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 40))
+# сколько запросов отправляется в одном пакетном поиске
+RETRIEVAL_CHUNK_SIZE = int(os.getenv("RETRIEVAL_CHUNK_SIZE", 256))
+
 
 class ArticlesDAO(BaseDAO):
     model = Article
 
     @classmethod
-    async def find_articles_without_analysis(cls, feed_id, req_id):
+    async def find_articles_without_analysis(
+        cls, feed_id, req_id, after_id=None, limit=None
+    ):
+        """Articles of the feed with embeddings but without an answer for
+        the analysis. With `limit` rows are returned page by page in
+        article_id order: the next page starts after the last article_id
+        of the previous one
+
+        Args:
+            feed_id (int): feed of the articles
+            req_id (int): analysis to check answers for
+            after_id (int, optional): last article_id of the previous page
+            limit (int, optional): page size, all articles if not set
+
+        Returns:
+            list[Article]: articles without answers
+        """
         async with async_session_maker() as session:
             stmt = select(cls.model).where(
                 cls.model.feed_id == feed_id,
+                # статьи без эмбеддингов ждут `app.py reembed`
+                cls.model.embeddings.isnot(None),
                 # Статьи которые не обрабатывались в рамках запроса
                 ~exists().where(
                     LLMConnection.article_id == Article.article_id,
@@ -24,39 +53,229 @@ class ArticlesDAO(BaseDAO):
                     AnalysisRequest.is_active,
                 ),
             )
+            if after_id is not None:
+                stmt = stmt.where(cls.model.article_id > after_id)
+            if limit is not None:
+                stmt = stmt.order_by(cls.model.article_id).limit(limit)
             result = await session.execute(stmt)
             return result.scalars().all()
 
+    @classmethod
+    async def find_content_hashes(cls, article_ids: list[int]) -> dict[int, int]:
+        """Returns content hashes of already stored articles that have embeddings
+
+        Args:
+            article_ids (list[int]): ids of the articles to check
+
+        Returns:
+            dict[int, int]: article_id -> content_hash
+        """
+        if not article_ids:
+            return {}
+        async with async_session_maker() as session:
+            stmt = select(cls.model.article_id, cls.model.content_hash).where(
+                cls.model.article_id.in_(article_ids),
+                cls.model.embeddings.isnot(None),
+            )
+            result = await session.execute(stmt)
+            return dict(result.all())
+
+    @staticmethod
+    async def set_search_params(session, ef_search=None, probes=None):
+        """Sets ANN search parameters for the current transaction only
+
+        Args:
+            session (AsyncSession): session with an open transaction
+            ef_search (int, optional): size of the HNSW candidate list
+            probes (int, optional): number of IVFFlat lists to visit
+        """
+        # SET не принимает параметры запроса, поэтому значения приводятся к int
+        if ef_search is not None:
+            await session.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+        if probes is not None:
+            await session.execute(text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+
     @classmethod
     async def get_relevant_data_from_articles(
-        cls, query_embedding, max_entries=5, choose_labeled=False
+        cls,
+        query_embedding,
+        max_entries=5,
+        choose_labeled=False,
+        candidates=None,
+        ef_search=None,
+        probes=None,
     ):
+        """Finds articles closest to the query that already have model answers.
+        Nearest neighbours are selected by the vector index first, joins with
+        llm_conns and analyses are applied only to these candidates
+
+        Args:
+            query_embedding (list[float]): query vector
+            max_entries (int, optional): number of rows to return. Defaults to 5.
+            choose_labeled (bool, optional): only answers labeled by users.
+            candidates (int, optional): number of ANN candidates to join.
+                Defaults to ANN_CANDIDATES_FACTOR * max_entries.
+            ef_search (int, optional): HNSW candidate list size, not less
+                than candidates by default.
+            probes (int, optional): IVFFlat lists to visit, if IVFFlat is used.
+
+        Returns:
+            list[Row]: title, description, category and response
+        """
+        candidates = candidates or max_entries * ANN_CANDIDATES_FACTOR
+        # HNSW не вернёт больше кандидатов, чем ef_search
+        ef_search = ef_search or max(candidates, HNSW_EF_SEARCH)
         async with async_session_maker() as session:
-            stmt = (
+            await cls.set_search_params(session, ef_search=ef_search, probes=probes)
+            distance = Article.embeddings.cosine_distance(query_embedding)
+            nearest = (
                 select(
+                    Article.article_id,
                     Article.title,
                     Article.description,
+                    distance.label("distance"),
+                )
+                .order_by(distance)
+                .limit(candidates)
+                .subquery()
+            )
+            stmt = (
+                select(
+                    nearest.c.title,
+                    nearest.c.description,
                     AnalysisRequest.category,
                     LLMConnection.response,
                 )
-                .join(LLMConnection, Article.article_id == LLMConnection.article_id)
+                .select_from(nearest)
+                .join(LLMConnection, nearest.c.article_id == LLMConnection.article_id)
                 .join(
                     AnalysisRequest,
                     LLMConnection.request_id == AnalysisRequest.request_id,
                 )
-                # .where(
-                #     LLMConnection.labeled == True,
-                # )
-                .order_by(Article.embeddings.cosine_distance(query_embedding))
+                .order_by(nearest.c.distance)
                 .limit(max_entries)
             )
             if choose_labeled:
-                stmt = stmt.where(LLMConnection.labeled == True)  # noqa
+                stmt = stmt.where(LLMConnection.is_labeled)
+
+            result = await session.execute(stmt)
+            return result.all()
+
+    @classmethod
+    async def get_relevant_data_for_many(
+        cls,
+        query_embeddings,
+        max_entries=5,
+        choose_labeled=False,
+        candidates=None,
+        ef_search=None,
+        probes=None,
+        chunk_size=RETRIEVAL_CHUNK_SIZE,
+    ):
+        """Batch version of get_relevant_data_from_articles: nearest neighbours
+        for every row of the query matrix are found in a single statement
+        (LATERAL join over unnest of query vectors), one round trip per chunk
+
+        Args:
+            query_embeddings (np.ndarray | list[list[float]]): query vectors
+            max_entries (int, optional): rows per query. Defaults to 5.
+            choose_labeled (bool, optional): only answers labeled by users.
+            candidates (int, optional): number of ANN candidates per query.
+            ef_search (int, optional): HNSW candidate list size.
+            probes (int, optional): IVFFlat lists to visit.
+            chunk_size (int, optional): number of queries in one statement.
+
+        Returns:
+            list[list[Row]]: title, description, category and response per query
+        """
+        candidates = candidates or max_entries * ANN_CANDIDATES_FACTOR
+        ef_search = ef_search or max(candidates, HNSW_EF_SEARCH)
+        labeled_filter = "WHERE llm_conns.is_labeled" if choose_labeled else ""
+        stmt = text(
+            f"""
+            SELECT q.ord, c.title, c.description, c.category, c.response
+            FROM unnest(CAST(:queries AS text[])) WITH ORDINALITY AS q(embedding, ord)
+            CROSS JOIN LATERAL (
+                SELECT nearest.title, nearest.description, analyses.category,
+                       llm_conns.response, nearest.distance
+                FROM (
+                    SELECT article_id, title, description,
+                           embeddings <=> CAST(q.embedding AS vector) AS distance
+                    FROM articles
+                    ORDER BY embeddings <=> CAST(q.embedding AS vector)
+                    LIMIT :candidates
+                ) AS nearest
+                JOIN llm_conns ON llm_conns.article_id = nearest.article_id
+                JOIN analyses ON analyses.request_id = llm_conns.request_id
+                {labeled_filter}
+                ORDER BY nearest.distance
+                LIMIT :max_entries
+            ) AS c
+            ORDER BY q.ord, c.distance
+            """
+        ).columns(
+            ord=Integer,
+            title=String,
+            description=String,
+            category=String,
+            response=JSONB,
+        )
+
+        # векторы передаются в текстовом формате pgvector: [x1,x2,...]
+        queries = [
+            "[" + ",".join(map(str, row)) + "]"
+            for row in np.asarray(query_embeddings, dtype=np.float32).tolist()
+        ]
+        results = [[] for _ in queries]
+        async with async_session_maker() as session:
+            await cls.set_search_params(session, ef_search=ef_search, probes=probes)
+            for start in range(0, len(queries), chunk_size):
+                rows = await session.execute(
+                    stmt,
+                    {
+                        "queries": queries[start : start + chunk_size],
+                        "candidates": candidates,
+                        "max_entries": max_entries,
+                    },
+                )
+                for position, *row in rows:
+                    results[start + position - 1].append(tuple(row))
+        return results
+
+    @classmethod
+    async def find_retrieval_rows(cls, updated_since=None):
+        """Returns embeddings of articles with model answers for the in-memory
+        vector index, only rows changed since `updated_since` if it is set
 
-            stmt = stmt.order_by(
-                Article.embeddings.cosine_distance(query_embedding)
-            ).limit(max_entries)
+        Args:
+            updated_since (datetime, optional): watermark of the previous load
 
+        Returns:
+            list[Row]: conn_id, embeddings, title, description, category,
+            response, is_labeled and updated_at
+        """
+        updated_at = func.greatest(Article.updated_at, LLMConnection.updated_at)
+        async with async_session_maker() as session:
+            stmt = (
+                select(
+                    LLMConnection.conn_id,
+                    Article.embeddings,
+                    Article.title,
+                    Article.description,
+                    AnalysisRequest.category,
+                    LLMConnection.response,
+                    LLMConnection.is_labeled,
+                    updated_at.label("updated_at"),
+                )
+                .join(LLMConnection, Article.article_id == LLMConnection.article_id)
+                .join(
+                    AnalysisRequest,
+                    LLMConnection.request_id == AnalysisRequest.request_id,
+                )
+                .where(Article.embeddings.isnot(None))
+            )
+            if updated_since is not None:
+                stmt = stmt.where(updated_at >= updated_since)
             result = await session.execute(stmt)
             return result.all()
 
@@ -65,16 +284,52 @@ class ArticlesDAO(BaseDAO):
         cls,
         df,
     ):
+        """Bulk upsert of articles: rows are streamed with binary COPY into
+        a temporary staging table and merged into `articles` with a single
+        INSERT ... ON CONFLICT, so the number of round trips does not depend
+        on the number of rows. Embeddings are sent in pgvector binary format.
+
+        Args:
+            df (pd.DataFrame): articles, columns must match `articles` columns
+        """
+        if df.empty:
+            return
+        columns = [c for c in df.columns if c in cls.model.__table__.columns]
+        # tolist() приводит numpy-типы к python-типам, которые понимает asyncpg
+        records = list(zip(*(df[c].tolist() for c in columns)))
+        column_list = ", ".join(columns)
+        update_list = ", ".join(
+            f"{c} = EXCLUDED.{c}" for c in columns if c != "article_id"
+        )
+
         async with async_session_maker() as session:
-            for _, row in df.iterrows():  # Итерируемся по строкам DataFrame
-                entry = row.to_dict()  # Преобразуем строку в словарь
-                stmt = (
-                    insert(Article)
-                    .values(**entry)  # Теперь entry — это словарь
-                    .on_conflict_do_update(
-                        index_elements=["article_id"],  # Уникальный ключ для проверки
-                        set_=entry,  # Обновляем все поля
-                    )
+            await session.execute(
+                text(
+                    "CREATE TEMP TABLE articles_stage "
+                    "(LIKE articles INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+            )
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+            # бинарный кодек нужен только для COPY, остальные запросы
+            # передают векторы через sqlalchemy в текстовом виде
+            await register_vector(driver_connection)
+            try:
+                await driver_connection.copy_records_to_table(
+                    "articles_stage", records=records, columns=columns
                 )
-                await session.execute(stmt)
+            finally:
+                await driver_connection.reset_type_codec("vector")
+
+            # DISTINCT ON защищает от повторов article_id внутри одной пачки
+            await session.execute(
+                text(
+                    f"INSERT INTO articles ({column_list}) "
+                    f"SELECT DISTINCT ON (article_id) {column_list} "
+                    "FROM articles_stage ORDER BY article_id "
+                    "ON CONFLICT (article_id) DO UPDATE "
+                    f"SET {update_list}, updated_at = now()"
+                )
+            )
             await session.commit()
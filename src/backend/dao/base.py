@@ -1,7 +1,7 @@
 # DAO (Data Access Object)
 
 from database.database import async_session_maker
-from sqlalchemy import delete
+from sqlalchemy import delete, update
 from sqlalchemy.future import select
 
 
@@ -21,7 +21,9 @@ class BaseDAO:
         """
 
         async with async_session_maker() as session:
-            query = select(cls.model).filter_by(id=data_id)
+            # у моделей разные имена первичных ключей (request_id, feed_id, ...)
+            primary_key = cls.model.__mapper__.primary_key[0]
+            query = select(cls.model).where(primary_key == data_id)
             result = await session.execute(query)
             return result.scalar_one_or_none()
 
@@ -76,6 +78,8 @@ class BaseDAO:
             except Exception as e:
                 await session.rollback()
                 raise ValueError(f"Add failed: {str(e)}")
+            # после commit объект устарел, а вне сессии его уже не загрузить
+            await session.refresh(new_instance)
             return new_instance
 
     @classmethod
@@ -111,6 +115,55 @@ class BaseDAO:
                 await session.rollback()
                 raise ValueError(f"Update failed: {str(e)}")
 
+    @classmethod
+    async def find_embedding_page(
+        cls, text_column: str, after_id: int = 0, limit: int = 256, only_missing=False
+    ) -> list[tuple[int, str]]:
+        """
+        Возвращает страницу (id, текст) для пересчёта эмбеддингов, по возрастанию id.
+
+        :param text_column: Колонка с текстом, по которому считается эмбеддинг
+        :param after_id: Последний id предыдущей страницы
+        :param limit: Размер страницы
+        :param only_missing: Только записи без эмбеддинга
+        :return: Список пар (id, текст)
+        """
+        primary_key = cls.model.__mapper__.primary_key[0]
+        stmt = (
+            select(primary_key, getattr(cls.model, text_column))
+            .where(primary_key > after_id)
+            .order_by(primary_key)
+            .limit(limit)
+        )
+        if only_missing:
+            stmt = stmt.where(cls.model.embeddings.is_(None))
+        async with async_session_maker() as session:
+            result = await session.execute(stmt)
+            return [tuple(row) for row in result.all()]
+
+    @classmethod
+    async def update_embeddings(cls, ids: list[int], embeddings) -> None:
+        """
+        Записывает эмбеддинги одним пакетным UPDATE по первичному ключу.
+
+        :param ids: Идентификаторы записей
+        :param embeddings: Векторы в том же порядке
+        """
+        primary_key = cls.model.__mapper__.primary_key[0]
+        async with async_session_maker() as session:
+            try:
+                await session.execute(
+                    update(cls.model),
+                    [
+                        {primary_key.key: id_, "embeddings": vector}
+                        for id_, vector in zip(ids, embeddings)
+                    ],
+                )
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Update failed: {str(e)}")
+
     # async def update(cls, id: int, **values):
     #     """
     #     Асинхронно обновляет экземпляр модели с указанными значениями.
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from database.database import async_session_maker, engine
+from dotenv import load_dotenv
+from sqlalchemy import func, insert, select, update
+
+from backend.dao.base import BaseDAO
+from backend.database.models import (
+    AnalysisRequest,
+    Article,
+    Document,
+    LLMConnection,
+)
+
+load_dotenv()
+
+# канал Postgres, в который публикуются номера новых ответов модели
+RESULTS_CHANNEL = os.getenv("RESULTS_CHANNEL", "analysis_results")
+# пауза между попытками заново подключить слушателя канала
+LISTENER_RETRY_SECONDS = 5
+
+
+class LLMConnectionsDAO(BaseDAO):
+    model = LLMConnection
+
+    @classmethod
+    async def add_results(cls, results: list[dict]) -> list[int]:
+        """Stores model answers with one INSERT. Every answer gets `seq`, its
+        number within the analysis: numbers are taken from
+        analyses.results_seq under the row lock held until commit, so they
+        grow in commit order and `seq > cursor` never skips an answer
+        committed later. The last number is published to RESULTS_CHANNEL
+        as {"req_id", "seq"} in the same transaction
+
+        Args:
+            results (list[dict]): request_id, article_id or document_id and
+                response of every answer, all with the same keys
+
+        Returns:
+            list[int]: conn_id of every answer in the same order
+        """
+        if not results:
+            return []
+        results = [dict(row) for row in results]
+        by_request = defaultdict(list)
+        for row in results:
+            by_request[row["request_id"]].append(row)
+        async with async_session_maker() as session:
+            try:
+                # анализы блокируются в порядке id, чтобы воркеры не ждали
+                # друг друга по кругу
+                for request_id in sorted(by_request):
+                    rows = by_request[request_id]
+                    stmt = (
+                        update(AnalysisRequest)
+                        .where(AnalysisRequest.request_id == request_id)
+                        .values(results_seq=AnalysisRequest.results_seq + len(rows))
+                        .returning(AnalysisRequest.results_seq)
+                    )
+                    last = (await session.execute(stmt)).scalar_one()
+                    for seq, row in enumerate(rows, start=last - len(rows) + 1):
+                        row["seq"] = seq
+                    payload = json.dumps({"req_id": request_id, "seq": last})
+                    await session.execute(
+                        select(func.pg_notify(RESULTS_CHANNEL, payload))
+                    )
+                stmt = insert(cls.model).values(results).returning(cls.model.conn_id)
+                conn_ids = (await session.execute(stmt)).scalars().all()
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Add failed: {str(e)}")
+        return list(conn_ids)
+
+    @classmethod
+    async def find_results(
+        cls, request_id: int, after_seq: int = 0, limit: int = 100
+    ):
+        """Answers of the analysis with titles of their sources, in `seq`
+        order. Pages are read by keyset: the next page starts after the last
+        seq of the previous one
+
+        Args:
+            request_id (int): analysis of the answers
+            after_seq (int, optional): last seq of the previous page
+            limit (int, optional): page size
+
+        Returns:
+            list[Row]: seq, conn_id, article_id, document_id, title, link,
+            response and created_at
+        """
+        async with async_session_maker() as session:
+            stmt = (
+                select(
+                    cls.model.seq,
+                    cls.model.conn_id,
+                    cls.model.article_id,
+                    cls.model.document_id,
+                    func.coalesce(Article.title, Document.title).label("title"),
+                    func.coalesce(Article.link, Document.url).label("link"),
+                    cls.model.response,
+                    cls.model.created_at,
+                )
+                .outerjoin(Article, cls.model.article_id == Article.article_id)
+                .outerjoin(Document, cls.model.document_id == Document.document_id)
+                .where(
+                    cls.model.request_id == request_id,
+                    cls.model.seq > after_seq,
+                )
+                .order_by(cls.model.seq)
+                .limit(limit)
+            )
+            result = await session.execute(stmt)
+            return result.all()
+
+
+class ResultsListener:
+    def __init__(self, channel: str = RESULTS_CHANNEL):
+        """LISTENs to the results channel on one dedicated connection per
+        process and wakes up subscribers of an analysis, so open streams do
+        not hold connections of the pool. A lost connection is reopened in
+        the background; all subscribers are woken up after that to re-read
+        answers they could have missed
+
+        Args:
+            channel (str, optional): Postgres channel of the results
+        """
+        self.channel = channel
+        self.queues: dict[int, set[asyncio.Queue]] = defaultdict(set)
+        self.connection = None
+        self.reconnecting = None
+        # задачи закрытия разорванных соединений, ссылки нужны до их завершения
+        self.releasing: set[asyncio.Task] = set()
+        self.lock = asyncio.Lock()
+
+    def dispatch(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        for queue in self.queues.get(message["req_id"], ()):
+            queue.put_nowait(message["seq"])
+
+    def wake_all(self):
+        for queues in self.queues.values():
+            for queue in queues:
+                queue.put_nowait(None)
+
+    def disconnected(self, connection):
+        lost, self.connection = self.connection, None
+        if lost is not None:
+            # соединение уже разорвано, возвращаем его в пул без ожидания сервера
+            task = asyncio.create_task(self.release(lost))
+            self.releasing.add(task)
+            task.add_done_callback(self.releasing.discard)
+        if self.queues and self.reconnecting is None:
+            self.reconnecting = asyncio.create_task(self.reconnect())
+
+    async def release(self, connection):
+        try:
+            await connection.invalidate()
+        except Exception as e:
+            print(f"Results listener connection release failed: {e}")
+
+    async def reconnect(self):
+        try:
+            while self.queues:
+                try:
+                    await self.start()
+                except Exception as e:
+                    print(f"Results listener reconnect failed: {e}")
+                    await asyncio.sleep(LISTENER_RETRY_SECONDS)
+                    continue
+                self.wake_all()
+                return
+        finally:
+            self.reconnecting = None
+
+    async def start(self):
+        async with self.lock:
+            if self.connection is not None:
+                return
+            connection = await engine.connect()
+            try:
+                raw_connection = await connection.get_raw_connection()
+                driver_connection = raw_connection.driver_connection
+                await driver_connection.add_listener(self.channel, self.dispatch)
+                driver_connection.add_termination_listener(self.disconnected)
+            except Exception:
+                await connection.close()
+                raise
+            self.connection = connection
+
+    async def stop(self):
+        async with self.lock:
+            if self.reconnecting is not None:
+                self.reconnecting.cancel()
+            if self.connection is not None:
+                connection, self.connection = self.connection, None
+                await connection.close()
+
+    @asynccontextmanager
+    async def subscribe(self, request_id: int):
+        """Yields a queue that receives the last seq of every committed
+        batch of the analysis, or None after a reconnect"""
+        await self.start()
+        queue = asyncio.Queue()
+        self.queues[request_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self.queues[request_id].discard(queue)
+            if not self.queues[request_id]:
+                del self.queues[request_id]
+
+
+results_listener = ResultsListener()
@@ -1,12 +1,27 @@
 import datetime
+import os
 
 from pgvector.sqlalchemy import Vector
-from sqlalchemy import Column, ForeignKey, String, Table, UniqueConstraint
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    ForeignKey,
+    Index,
+    String,
+    Table,
+    UniqueConstraint,
+    func,
+    text,
+)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
 
+# размерность векторов модели эмбеддингов, при смене нужна миграция и `app.py reembed`;
+# миграция b4e8d1f7a2c6 берёт её из окружения, значение должно совпадать
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 768))
+
 # Промежуточная таблица для связи многие-ко-многим
 user_feed_association = Table(
     "user_feed_association",
@@ -46,6 +61,17 @@ class User(Base):
     UniqueConstraint("provider", "provider_id", name="uix_provider_id_provider")
 
 
+def hnsw_index(name: str) -> Index:
+    """HNSW-индекс по косинусному расстоянию для колонки embeddings"""
+    return Index(
+        name,
+        "embeddings",
+        postgresql_using="hnsw",
+        postgresql_with={"m": 16, "ef_construction": 64},
+        postgresql_ops={"embeddings": "vector_cosine_ops"},
+    )
+
+
 # есть RSS-фиды который задаются пользователями
 class Feed(Base):
     __tablename__ = "feeds"
@@ -53,6 +79,9 @@ class Feed(Base):
     url: Mapped[str] = mapped_column(unique=True)
     title: Mapped[str | None] = mapped_column(String(200))
     description: Mapped[str | None] = mapped_column(String(600))
+    # валидаторы HTTP-кэша для условных запросов (If-None-Match / If-Modified-Since)
+    etag: Mapped[str | None] = mapped_column(String(200))
+    last_modified: Mapped[str | None] = mapped_column(String(100))
 
     # Связь многие-ко-многим с User
     users: Mapped[list["User"]] = relationship(
@@ -72,12 +101,15 @@ class Feed(Base):
 # у RSS-фида есть набор статей
 class Article(Base):
     __tablename__ = "articles"
+    __table_args__ = (hnsw_index("ix_articles_embeddings_hnsw"),)
     article_id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(String(200))
     description: Mapped[str | None] = mapped_column(String(600))
     link: Mapped[str] = mapped_column(unique=True)
     pub_date: Mapped[datetime.datetime] = mapped_column()
-    embeddings = mapped_column(Vector(768))
+    embeddings = mapped_column(Vector(EMBEDDING_DIM))
+    # хэш заголовка и описания, по нему определяем нужно ли пересчитывать эмбеддинг
+    content_hash: Mapped[int | None] = mapped_column()
 
     feed_id: Mapped[int] = mapped_column(
         ForeignKey("feeds.feed_id", ondelete="CASCADE")
@@ -91,12 +123,13 @@ class Article(Base):
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (hnsw_index("ix_documents_embeddings_hnsw"),)
     document_id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(String(200))
     description: Mapped[str | None] = mapped_column(String(600))
     content: Mapped[str | None] = mapped_column()
     url: Mapped[str | None] = mapped_column()
-    embeddings = mapped_column(Vector(768))
+    embeddings = mapped_column(Vector(EMBEDDING_DIM))
 
     user_id: Mapped[int] = mapped_column(
         ForeignKey("users.user_id", ondelete="CASCADE")
@@ -117,6 +150,12 @@ class AnalysisRequest(Base):
     examples: Mapped[str | None] = mapped_column(String(400))
     is_active: Mapped[bool] = mapped_column(default=True)
     analysis_type: Mapped[str] = mapped_column()
+    # когда планировщик последний раз ставил мониторинг в очередь
+    last_run_at: Mapped[datetime.datetime | None] = mapped_column()
+    # последний номер ответа анализа, выдаётся под блокировкой строки
+    results_seq: Mapped[int] = mapped_column(
+        BigInteger, default=0, server_default=text("0")
+    )
     user_id: Mapped[int] = mapped_column(
         ForeignKey("users.user_id", ondelete="CASCADE")
     )
@@ -129,7 +168,10 @@ class AnalysisRequest(Base):
 
 class LLMConnection(Base):
     __tablename__ = "llm_conns"
+    __table_args__ = (Index("ix_llm_conns_request_seq", "request_id", "seq"),)
     conn_id: Mapped[int] = mapped_column(primary_key=True)
+    # номер ответа внутри анализа в порядке commit, курсор потока результатов
+    seq: Mapped[int | None] = mapped_column(BigInteger)
     response = mapped_column(JSONB, nullable=True)  # ответ модели
     is_labeled: Mapped[bool] = mapped_column(
         default=False
@@ -146,6 +188,28 @@ class LLMConnection(Base):
     )
 
 
+# очередь фоновых задач: воркеры забирают их через SELECT ... FOR UPDATE SKIP LOCKED
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_claim", "status", text("priority DESC"), "run_after"),
+    )
+    job_id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20))  # analysis, feed or document
+    payload = mapped_column(JSONB, default=dict)
+    priority: Mapped[int] = mapped_column(default=0)  # больше -- раньше
+    # queued, running, done, dead
+    status: Mapped[str] = mapped_column(String(20), default="queued")
+    attempts: Mapped[int] = mapped_column(default=0)
+    max_attempts: Mapped[int] = mapped_column(default=3)
+    run_after: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
+    locked_by: Mapped[str | None] = mapped_column(String(100))
+    lease_expires_at: Mapped[datetime.datetime | None] = mapped_column()
+    last_error: Mapped[str | None] = mapped_column()
+    progress = mapped_column(JSONB, nullable=True)  # этап и счётчики для клиента
+    result = mapped_column(JSONB, nullable=True)
+
+
 # Храниим сессии пользователей
 class Session(Base):
     __tablename__ = "sessions"
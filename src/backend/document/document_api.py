@@ -37,5 +37,5 @@ async def process(req_id: int, document_id: int):
     args = Args()
     args.document_id = document.document_id
     args.req_id = analysis.request_id
-    await process()
+    await process(args)
     return {"message": "Processing started!"}
@@ -1,7 +1,7 @@
 from dao.base import BaseDAO
 from database.database import async_session_maker
 from database.models import Feed
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.dialects.postgresql import insert
 
 from backend.database.models import user_feed_association
@@ -13,10 +13,47 @@ class FeedsDAO(BaseDAO):
     @classmethod
     async def get_all_feed_ids_with_urls(cls):
         async with async_session_maker() as session:
-            stmt = select(cls.model.feed_id, cls.model.url)
+            stmt = select(
+                cls.model.feed_id,
+                cls.model.url,
+                cls.model.etag,
+                cls.model.last_modified,
+            )
             result = await session.execute(stmt)
             return result.all()
 
+    @classmethod
+    async def find_feed_ids_of_user(cls, user_id: int) -> list[int]:
+        async with async_session_maker() as session:
+            stmt = select(user_feed_association.c.feed_id).where(
+                user_feed_association.c.user_id == user_id
+            )
+            result = await session.execute(stmt)
+            return result.scalars().all()
+
+    @classmethod
+    async def update_validators(cls, validators: dict[int, tuple[str, str]]):
+        """Saves ETag and Last-Modified values of downloaded feeds
+
+        Args:
+            validators (dict[int, tuple[str, str]]): feed_id -> (etag, last_modified)
+        """
+        if not validators:
+            return
+        async with async_session_maker() as session:
+            for feed_id, (etag, last_modified) in validators.items():
+                stmt = (
+                    update(cls.model)
+                    .where(cls.model.feed_id == feed_id)
+                    .values(etag=etag, last_modified=last_modified)
+                )
+                await session.execute(stmt)
+            try:
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Feed validators update failed: {str(e)}")
+
     @classmethod
     async def connect_user_to_existing_feed(cls, user_id, feed_id):
         async with async_session_maker() as session:
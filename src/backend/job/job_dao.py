@@ -0,0 +1,269 @@
+import os
+
+from database.database import async_session_maker
+from dotenv import load_dotenv
+from sqlalchemy import func, or_, select, update
+
+from backend.dao.base import BaseDAO
+from backend.database.models import Job
+
+load_dotenv()
+
+JOB_KINDS = ("analysis", "feed", "document")
+# сколько секунд задача принадлежит воркеру без продления аренды
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))
+# задержка перед повтором, удваивается с каждой попыткой
+JOB_RETRY_BACKOFF = int(os.getenv("JOB_RETRY_BACKOFF", 30))
+
+
+def in_seconds(seconds: float):
+    """SQL expression of the moment `seconds` from now"""
+    return func.now() + func.make_interval(0, 0, 0, 0, 0, 0, seconds)
+
+
+class JobsDAO(BaseDAO):
+    model = Job
+
+    @classmethod
+    async def enqueue(
+        cls,
+        kind: str,
+        payload: dict,
+        priority: int = 0,
+        max_attempts: int = 3,
+    ) -> Job:
+        """Adds a job to the queue
+
+        Args:
+            kind (str): analysis, feed or document
+            payload (dict): arguments of the job handler, must be JSON-serializable
+            priority (int, optional): jobs with higher priority are claimed first
+            max_attempts (int, optional): attempts before the job is dead-lettered
+
+        Returns:
+            Job: queued job
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind {kind}, expected one of {JOB_KINDS}")
+        async with async_session_maker() as session:
+            job = cls.model(
+                kind=kind, payload=payload, priority=priority, max_attempts=max_attempts
+            )
+            session.add(job)
+            try:
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Job enqueue failed: {str(e)}")
+            # после commit объект устарел, загружаем id и значения по умолчанию
+            await session.refresh(job)
+            return job
+
+    @classmethod
+    async def claim(
+        cls,
+        worker_id: str,
+        kinds: list[str] | None = None,
+        lease_seconds: int = JOB_LEASE_SECONDS,
+    ) -> Job | None:
+        """Takes the most important ready job and leases it to the worker.
+        Jobs locked by other workers are skipped, so workers never wait for
+        each other; jobs whose lease expired (the worker died) are taken again
+
+        Args:
+            worker_id (str): unique name of the worker
+            kinds (list[str] | None, optional): kinds the worker can handle
+            lease_seconds (int, optional): lease duration
+
+        Returns:
+            Job | None: claimed job or None if the queue is empty
+        """
+        async with async_session_maker() as session:
+            # задачи с истёкшей арендой и исчерпанными попытками больше не берём
+            await session.execute(
+                update(cls.model)
+                .where(
+                    cls.model.status == "running",
+                    cls.model.lease_expires_at < func.now(),
+                    cls.model.attempts >= cls.model.max_attempts,
+                )
+                .values(status="dead", last_error="Lease expired", locked_by=None)
+            )
+            candidate = (
+                select(cls.model.job_id)
+                .where(
+                    or_(
+                        (cls.model.status == "queued")
+                        & (cls.model.run_after <= func.now()),
+                        (cls.model.status == "running")
+                        & (cls.model.lease_expires_at < func.now()),
+                    )
+                )
+                .order_by(cls.model.priority.desc(), cls.model.job_id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            if kinds:
+                candidate = candidate.where(cls.model.kind.in_(kinds))
+            stmt = (
+                update(cls.model)
+                .where(cls.model.job_id == candidate.scalar_subquery())
+                .values(
+                    status="running",
+                    locked_by=worker_id,
+                    attempts=cls.model.attempts + 1,
+                    lease_expires_at=in_seconds(lease_seconds),
+                )
+                .returning(cls.model)
+            )
+            try:
+                result = await session.execute(stmt)
+                job = result.scalar_one_or_none()
+                if job is not None:
+                    # объект нужен воркеру после закрытия сессии
+                    session.expunge(job)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Job claim failed: {str(e)}")
+            return job
+
+    @classmethod
+    async def _update_owned(cls, job_id: int, worker_id: str, **values) -> bool:
+        # менять задачу может только воркер, который её арендовал
+        async with async_session_maker() as session:
+            stmt = (
+                update(cls.model)
+                .where(
+                    cls.model.job_id == job_id,
+                    cls.model.locked_by == worker_id,
+                    cls.model.status == "running",
+                )
+                .values(**values)
+            )
+            try:
+                result = await session.execute(stmt)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Job update failed: {str(e)}")
+            return result.rowcount > 0
+
+    @classmethod
+    async def heartbeat(
+        cls, job_id: int, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS
+    ) -> bool:
+        """Extends the lease, returns False if the job is no longer owned"""
+        return await cls._update_owned(
+            job_id,
+            worker_id,
+            lease_expires_at=in_seconds(lease_seconds),
+        )
+
+    @classmethod
+    async def report_progress(cls, job_id: int, worker_id: str, progress: dict) -> bool:
+        return await cls._update_owned(job_id, worker_id, progress=progress)
+
+    @classmethod
+    async def complete(cls, job_id: int, worker_id: str, result=None) -> bool:
+        return await cls._update_owned(
+            job_id,
+            worker_id,
+            status="done",
+            result=result,
+            locked_by=None,
+            lease_expires_at=None,
+        )
+
+    @classmethod
+    async def fail(cls, job: Job, worker_id: str, error: str) -> bool:
+        """Returns the job to the queue with exponential backoff,
+        or moves it to the dead letters when attempts are exhausted"""
+        if job.attempts >= job.max_attempts:
+            return await cls._update_owned(
+                job.job_id,
+                worker_id,
+                status="dead",
+                last_error=error,
+                locked_by=None,
+                lease_expires_at=None,
+            )
+        delay = JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        return await cls._update_owned(
+            job.job_id,
+            worker_id,
+            status="queued",
+            last_error=error,
+            locked_by=None,
+            lease_expires_at=None,
+            run_after=in_seconds(delay),
+        )
+
+    @classmethod
+    async def count_pending(cls) -> int:
+        """Number of queued and running jobs"""
+        async with async_session_maker() as session:
+            stmt = select(func.count()).where(
+                cls.model.status.in_(("queued", "running"))
+            )
+            result = await session.execute(stmt)
+            return result.scalar_one()
+
+    @classmethod
+    async def find_pending_request_ids(cls) -> set[int]:
+        """Analyses which already have a queued or running job"""
+        async with async_session_maker() as session:
+            stmt = (
+                select(cls.model.payload["req_id"].as_integer())
+                .where(
+                    cls.model.status.in_(("queued", "running")),
+                    cls.model.payload.has_key("req_id"),
+                )
+                .distinct()
+            )
+            result = await session.execute(stmt)
+            return set(result.scalars().all())
+
+    @classmethod
+    async def find_pending_feed_ids(cls) -> set[int]:
+        """Feeds which already have a queued or running download"""
+        async with async_session_maker() as session:
+            stmt = select(cls.model.payload["feed_ids"]).where(
+                cls.model.kind == "feed",
+                cls.model.status.in_(("queued", "running")),
+            )
+            result = await session.execute(stmt)
+            return {
+                feed_id
+                for feed_ids in result.scalars().all()
+                for feed_id in feed_ids or ()
+            }
+
+    @classmethod
+    async def find_dead(cls, limit: int = 100) -> list[Job]:
+        async with async_session_maker() as session:
+            stmt = (
+                select(cls.model)
+                .where(cls.model.status == "dead")
+                .order_by(cls.model.updated_at.desc())
+                .limit(limit)
+            )
+            result = await session.execute(stmt)
+            return result.scalars().all()
+
+    @classmethod
+    async def requeue(cls, job_id: int) -> bool:
+        """Returns a dead job to the queue with a fresh attempt budget"""
+        async with async_session_maker() as session:
+            stmt = (
+                update(cls.model)
+                .where(cls.model.job_id == job_id, cls.model.status == "dead")
+                .values(status="queued", attempts=0, run_after=func.now())
+            )
+            try:
+                result = await session.execute(stmt)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise ValueError(f"Job requeue failed: {str(e)}")
+            return result.rowcount > 0
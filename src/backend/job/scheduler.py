@@ -0,0 +1,277 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from multiprocessing.process import BaseProcess
+
+from database.database import engine
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from backend.analysis.analysis_dao import AnalysesDAO
+from backend.database.models import Job
+from backend.feed.feed_dao import FeedsDAO
+from backend.job.job_dao import JobsDAO
+
+load_dotenv()
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 1))
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", 60))
+# как часто запускается мониторинг одного анализа
+MONITORING_INTERVAL_HOURS = float(os.getenv("MONITORING_INTERVAL_HOURS", 24))
+# больше задач в очереди планировщик не добавляет, пока воркеры не разберут старые
+SCHEDULER_MAX_PENDING = int(os.getenv("SCHEDULER_MAX_PENDING", 100))
+# видеокарты воркеров через запятую, воркеры распределяются по ним по кругу
+SCHEDULER_GPUS = [gpu for gpu in os.getenv("SCHEDULER_GPUS", "").split(",") if gpu]
+SCHEDULER_SHUTDOWN_SECONDS = float(os.getenv("SCHEDULER_SHUTDOWN_SECONDS", 600))
+# ключ advisory lock: при нескольких демонах задачи ставит только один
+SCHEDULER_LOCK_ID = 7240513
+
+
+def run_worker_process(index: int, gpu: str | None):
+    """Entry point of a worker process: one process holds one loaded model"""
+    if gpu is not None:
+        # до импорта torch, иначе процесс увидит все видеокарты
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpu
+    from backend.job.worker import JobWorker
+    from models.models import warm_up
+
+    components = [name for name in os.getenv("MODEL_WARMUP", "").split(",") if name]
+    if components:
+        warm_up(components)
+    asyncio.run(JobWorker(worker_id=f"{os.uname().nodename}:{os.getpid()}").run())
+
+
+async def enqueue_analysis_run(request_id: int, user_id: int) -> list[Job]:
+    """Queues one run of a monitoring analysis the same way Scheduler.tick
+    does: a `feed` job for every feed of the owner which then queues the
+    processing, or the processing job right away if the feed is already
+    being downloaded
+
+    Returns:
+        list[Job]: queued jobs
+    """
+    crawling = await JobsDAO.find_pending_feed_ids()
+    jobs = []
+    for feed_id in await FeedsDAO.find_feed_ids_of_user(user_id):
+        job = {"req_id": request_id, "feed_id": feed_id, "user_id": user_id}
+        if feed_id in crawling:
+            jobs.append(await JobsDAO.enqueue("analysis", job))
+            continue
+        payload = {"feed_ids": [feed_id], "analyses": [job]}
+        jobs.append(await JobsDAO.enqueue("feed", payload))
+    return jobs
+
+
+class Scheduler:
+    def __init__(
+        self,
+        workers: int = SCHEDULER_WORKERS,
+        tick_seconds: float = SCHEDULER_TICK_SECONDS,
+        interval_hours: float = MONITORING_INTERVAL_HOURS,
+        max_pending: int = SCHEDULER_MAX_PENDING,
+        gpus: list[str] = SCHEDULER_GPUS,
+        shutdown_seconds: float = SCHEDULER_SHUTDOWN_SECONDS,
+    ):
+        """Daemon which queues monitoring analyses when they are due and keeps
+        a pool of worker processes draining the queue
+
+        Every tick each feed of the owners of due analyses gets one `feed`
+        job, shared by all analyses reading the feed; after the download it
+        queues an `analysis` job per analysis to process the new articles.
+        An analysis is scheduled at most once per interval and never while
+        its previous jobs are still queued or running. Nothing is scheduled
+        while the queue holds max_pending jobs, so a slow cluster is not
+        flooded; an analysis with more feeds than fit is queued over
+        several ticks
+
+        Args:
+            workers (int): number of worker processes on this host, may be 0
+            tick_seconds (float): pause between scheduling rounds
+            interval_hours (float): min interval between runs of an analysis
+            max_pending (int): max number of queued and running jobs
+            gpus (list[str]): CUDA devices assigned to workers round-robin
+            shutdown_seconds (float): time for workers to finish current jobs
+        """
+        self.workers = workers
+        self.tick_seconds = tick_seconds
+        self.interval_hours = interval_hours
+        self.max_pending = max_pending
+        self.gpus = gpus
+        self.shutdown_seconds = shutdown_seconds
+        self.processes: dict[int, BaseProcess] = {}
+        # отдельное соединение держит блокировку лидера
+        self.connection = None
+        # request_id -> фиды анализа, уже поставленные в очередь в этом интервале
+        self.partial: dict[int, set[int]] = {}
+        self.context = multiprocessing.get_context("spawn")
+        self.stopping = asyncio.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def start_worker(self, index: int):
+        gpu = self.gpus[index % len(self.gpus)] if self.gpus else None
+        process = self.context.Process(
+            target=run_worker_process, args=(index, gpu), name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        print(f"Worker {index} started with pid {process.pid}, gpu {gpu}.")
+
+    def supervise(self):
+        """Restarts workers that exited unexpectedly"""
+        for index in range(self.workers):
+            process = self.processes.get(index)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    print(f"Worker {index} exited with code {process.exitcode}.")
+                self.start_worker(index)
+
+    async def tick(self) -> int:
+        """Queues due analyses, returns the number of new jobs"""
+        room = self.max_pending - await JobsDAO.count_pending()
+        if room <= 0:
+            print("Job queue is full, scheduling is postponed.")
+            return 0
+        busy = await JobsDAO.find_pending_request_ids()
+        crawling = await JobsDAO.find_pending_feed_ids()
+        due = await AnalysesDAO.find_due_monitoring(
+            self.interval_hours, limit=self.max_pending
+        )
+
+        # анализы, которые стали неактивными, больше не продолжаем
+        due_ids = {analysis.request_id for analysis in due}
+        self.partial = {k: v for k, v in self.partial.items() if k in due_ids}
+
+        # feed_id -> анализы, которые обработают фид после его загрузки
+        crawls: dict[int, list[dict]] = {}
+        processing: list[dict] = []
+        scheduled = []
+        for analysis in due:
+            # продолжение анализа, не поместившегося в прошлый раз, не ждёт его задач
+            done = self.partial.get(analysis.request_id)
+            if done is None and analysis.request_id in busy:
+                continue
+            done = done or set()
+            feed_ids = await FeedsDAO.find_feed_ids_of_user(analysis.user_id)
+            for feed_id in feed_ids:
+                if feed_id in done:
+                    continue
+                # фид, который уже загружается, не загружаем второй раз
+                new_crawl = feed_id not in crawls and feed_id not in crawling
+                cost = 2 if new_crawl else 1
+                if cost > room:
+                    break
+                room -= cost
+                job = {
+                    "req_id": analysis.request_id,
+                    "feed_id": feed_id,
+                    "user_id": analysis.user_id,
+                }
+                if feed_id in crawling:
+                    processing.append(job)
+                else:
+                    crawls.setdefault(feed_id, []).append(job)
+                done.add(feed_id)
+            if done.issuperset(feed_ids):
+                self.partial.pop(analysis.request_id, None)
+                scheduled.append(analysis.request_id)
+            else:
+                # остальные фиды анализа встанут в очередь на следующих тиках
+                self.partial[analysis.request_id] = done
+
+        for feed_id, analyses in crawls.items():
+            await JobsDAO.enqueue("feed", {"feed_ids": [feed_id], "analyses": analyses})
+        for job in processing:
+            await JobsDAO.enqueue("analysis", job)
+        await AnalysesDAO.mark_run(scheduled)
+        jobs = len(crawls) + len(processing)
+        if jobs:
+            print(
+                f"Scheduled {len(crawls)} feeds for {len(scheduled)} analyses "
+                f"with {jobs} jobs."
+            )
+        return jobs
+
+    async def check_leader(self) -> bool:
+        """Takes or confirms the leader lock. The advisory lock belongs to the
+        dedicated connection: if the connection drops, the server releases
+        the lock and another daemon may take it, so it is checked every tick"""
+        if self.connection is None:
+            self.connection = await engine.connect()
+        # ключ меньше 2^32: classid = 0, objid = ключ, objsubid = 1
+        held = (
+            await self.connection.execute(
+                text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_locks "
+                    "WHERE locktype = 'advisory' AND pid = pg_backend_pid() "
+                    "AND classid = 0 AND objid = :key AND objsubid = 1 AND granted)"
+                ),
+                {"key": SCHEDULER_LOCK_ID},
+            )
+        ).scalar()
+        if not held:
+            held = (
+                await self.connection.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"),
+                    {"key": SCHEDULER_LOCK_ID},
+                )
+            ).scalar()
+        await self.connection.commit()
+        return held
+
+    async def drop_connection(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            try:
+                await connection.invalidate()
+                await connection.close()
+            except Exception:
+                pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        leader = False
+        try:
+            while not self.stopping.is_set():
+                self.supervise()
+                was_leader = leader
+                try:
+                    leader = await self.check_leader()
+                except Exception as e:
+                    # соединение открывается заново на следующем тике,
+                    # воркеры продолжают работать
+                    print(f"Leader lock check failed: {e}")
+                    leader = False
+                    await self.drop_connection()
+                if was_leader and not leader:
+                    print("Scheduler lost the leader lock.")
+                if leader:
+                    try:
+                        await self.tick()
+                    except Exception as e:
+                        print(f"Scheduling failed: {e}")
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), self.tick_seconds)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.drop_connection()
+            await asyncio.to_thread(self.shutdown)
+
+    def shutdown(self):
+        """Asks workers to finish their current jobs, kills them after the timeout"""
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM: воркер доделывает текущую задачу
+        for index, process in self.processes.items():
+            process.join(self.shutdown_seconds)
+            if process.is_alive():
+                print(f"Worker {index} did not stop in time, killing it.")
+                process.kill()
+                process.join()
+        print("Scheduler stopped.")
@@ -0,0 +1,245 @@
+import asyncio
+import os
+import signal
+import socket
+from types import SimpleNamespace
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from backend.database.models import Job
+from backend.job.job_dao import JOB_LEASE_SECONDS, JobsDAO
+
+load_dotenv()
+
+# пауза между опросами пустой очереди
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+
+
+class JobContext:
+    def __init__(self, job: Job, worker_id: str):
+        """Gives a handler access to its job: progress reported here is
+        visible in `GET /analysis/jobs/{id}` and survives retries"""
+        self.job = job
+        self.worker_id = worker_id
+        self.state: dict = dict(job.progress or {})
+
+    async def progress(self, **values):
+        self.state.update(values)
+        await JobsDAO.report_progress(self.job.job_id, self.worker_id, self.state)
+
+
+async def handle_feed(payload: dict, context: JobContext) -> dict:
+    """Downloads new articles of the given feeds (all feeds if none given).
+    Analyses listed in `analyses` get their processing jobs afterwards"""
+    from backend.feed.feed_dao import FeedsDAO
+    from crawler.rss_crawler import import_data
+
+    if "articles" not in context.state:
+        feeds = await FeedsDAO.get_all_feed_ids_with_urls()
+        if payload.get("feed_ids"):
+            feeds = [feed for feed in feeds if feed.feed_id in payload["feed_ids"]]
+        await context.progress(stage="crawling", feeds=len(feeds))
+        await context.progress(articles=await import_data(feeds))
+    # при повторе задачи уже поставленные анализы не дублируются
+    queued = context.state.get("queued", 0)
+    for analysis in payload.get("analyses", [])[queued:]:
+        await JobsDAO.enqueue("analysis", analysis)
+        queued += 1
+        await context.progress(queued=queued)
+    return {"articles": context.state["articles"], "analyses": queued}
+
+
+async def handle_analysis(payload: dict, context: JobContext) -> dict:
+    """Processes unanalysed articles of a feed for a monitoring analysis"""
+    from rag.processor import process
+
+    await context.progress(stage="processing")
+    processed = await process(
+        SimpleNamespace(req_id=payload["req_id"], feed_id=payload["feed_id"]),
+        progress=lambda count: context.progress(processed=count),
+    )
+    return {"processed": processed}
+
+
+def embed_document(text: str):
+    from crawler.processor import get_embeddings
+    from models.models import get_device, get_embedder, get_embedding_tokenizer
+
+    embeddings, _ = get_embeddings(
+        get_embedding_tokenizer(), get_embedder(), get_device(), pd.DataFrame([text])
+    )
+    return embeddings[0]
+
+
+async def prepare_document(payload: dict, context: JobContext) -> int:
+    """Scrapes the page (if a url is given), embeds the text and stores
+    the document. The id is kept in the job progress, so a retry does not
+    create the document twice
+
+    Returns:
+        int: id of the stored document
+    """
+    from backend.document.document_dao import DocumentsDAO
+    from crawler.scraper.scraper.spiders.doc_crawler import scrape_documents
+    from utils import split_text_into_paragraphs
+
+    if context.state.get("document_id"):
+        return context.state["document_id"]
+
+    text, url = payload.get("text"), payload.get("url")
+    if url:
+        await context.progress(stage="scraping", url=url)
+        pages = await scrape_documents([url])
+        text = pages[0] if pages else ""
+    if not text:
+        raise ValueError("Document is empty")
+
+    await context.progress(stage="embedding", characters=len(text))
+    # модель считает в отдельном потоке, чтобы аренда задачи продлевалась
+    embedding = await asyncio.to_thread(embed_document, text)
+    document = await DocumentsDAO.add(
+        url=url,
+        title=split_text_into_paragraphs(text, 50)[0][:200],
+        description=split_text_into_paragraphs(text, 300)[0][:600],
+        content=text,
+        embeddings=embedding,
+        user_id=payload["user_id"],
+    )
+    await context.progress(document_id=document.document_id)
+    return document.document_id
+
+
+async def handle_document(payload: dict, context: JobContext) -> dict:
+    """Prepares a document if needed and processes it for a single analysis"""
+    from rag.processor import process
+
+    document_id = payload.get("document_id") or await prepare_document(
+        payload, context
+    )
+    await context.progress(stage="processing", document_id=document_id)
+    await process(SimpleNamespace(req_id=payload["req_id"], document_id=document_id))
+    return {"document_id": document_id}
+
+
+HANDLERS = {
+    "analysis": handle_analysis,
+    "feed": handle_feed,
+    "document": handle_document,
+}
+
+
+class JobWorker:
+    def __init__(
+        self,
+        worker_id: str = None,
+        kinds: list[str] = None,
+        handlers: dict = None,
+        poll_seconds: float = JOB_POLL_SECONDS,
+        lease_seconds: int = JOB_LEASE_SECONDS,
+    ):
+        """Drains the job queue: claims a job, runs its handler while extending
+        the lease, then marks it done or failed. Any number of workers can run
+        against the same queue, a job is executed by one of them at a time
+
+        Args:
+            worker_id (str, optional): unique name, defaults to host:pid
+            kinds (list[str], optional): kinds of jobs to take, all by default
+            handlers (dict, optional): kind -> async handler of the payload
+                and JobContext
+            poll_seconds (float, optional): pause when the queue is empty
+            lease_seconds (int, optional): lease duration, extended while running
+        """
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers = handlers or HANDLERS
+        self.kinds = kinds or list(self.handlers)
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.stopping = asyncio.Event()
+
+    def stop(self):
+        """Finishes the current job and exits the loop"""
+        self.stopping.set()
+
+    async def run(self, max_jobs: int = None):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        print(f"Worker {self.worker_id} started for {', '.join(self.kinds)} jobs.")
+        done = 0
+        while not self.stopping.is_set() and (max_jobs is None or done < max_jobs):
+            if await self.run_one():
+                done += 1
+                continue
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+        print(f"Worker {self.worker_id} stopped after {done} jobs.")
+
+    async def run_one(self) -> bool:
+        """Runs a single job, returns False if the queue had nothing to do"""
+        job = await JobsDAO.claim(self.worker_id, self.kinds, self.lease_seconds)
+        if job is None:
+            return False
+        print(f"Job {job.job_id} ({job.kind}), attempt {job.attempts}.")
+        context = JobContext(job, self.worker_id)
+        handler = asyncio.create_task(
+            self.handlers[job.kind](job.payload or {}, context)
+        )
+        heartbeat = asyncio.create_task(self.heartbeat(job, handler))
+        try:
+            result = await handler
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled() and heartbeat.result():
+                # задачу уже может выполнять другой воркер, результат не пишем
+                print(f"Job {job.job_id} cancelled: the lease was lost.")
+                return True
+            raise
+        except Exception as e:
+            print(f"Job {job.job_id} failed: {e}")
+            await self.finish(job, JobsDAO.fail(job, self.worker_id, str(e)))
+        else:
+            await self.finish(
+                job, JobsDAO.complete(job.job_id, self.worker_id, result)
+            )
+        finally:
+            heartbeat.cancel()
+        return True
+
+    async def finish(self, job: Job, update) -> None:
+        # если статус записать не удалось, аренда истечёт и задачу возьмут снова
+        try:
+            if not await update:
+                print(f"Job {job.job_id} is no longer owned, result dropped.")
+        except Exception as e:
+            print(f"Job {job.job_id} status update failed: {e}")
+
+    async def heartbeat(self, job: Job, handler: asyncio.Task) -> bool:
+        """Extends the lease while the handler runs. Cancels the handler and
+        returns True when the lease is lost: the job was taken by another
+        worker, or it could not be renewed before expiring"""
+        loop = asyncio.get_running_loop()
+        renewed = loop.time()
+        interval = self.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                owned = await JobsDAO.heartbeat(
+                    job.job_id, self.worker_id, self.lease_seconds
+                )
+            except Exception as e:
+                # временные ошибки БД: пробуем снова, пока аренда не истекла
+                print(f"Heartbeat of job {job.job_id} failed: {e}")
+                owned = loop.time() - renewed < self.lease_seconds
+                interval = min(self.lease_seconds / 10, 5)
+            else:
+                renewed = loop.time()
+                interval = self.lease_seconds / 3
+            if not owned:
+                print(f"Lost the lease of job {job.job_id}.")
+                handler.cancel()
+                return True
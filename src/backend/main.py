@@ -1,5 +1,7 @@
+import asyncio
 import os
 import sys
+from contextlib import asynccontextmanager
 
 sys.path.insert(1, os.path.join(sys.path[0], ".."))
 
@@ -10,10 +12,31 @@ from fastapi.middleware.cors import CORSMiddleware
 from feed.feed_api import router as feed_router
 
 from backend.analysis.analysis_api import router as analysis_router
+from backend.document.document_api import router as document_router
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # прогрев моделей при старте, чтобы первый запрос не ждал загрузку.
+    # MODEL_WARMUP=embedder,generator; без него модели грузятся при первом запросе
+    components = [
+        name.strip() for name in os.getenv("MODEL_WARMUP", "").split(",") if name
+    ]
+    if os.getenv("GENERATOR_WARMUP", "").lower() in ("1", "true", "on"):
+        components.append("generator")
+    if components:
+        from models.models import warm_up
+
+        await asyncio.to_thread(warm_up, components)
+    yield
+    from backend.dao.llm_conn_dao import results_listener
+
+    await results_listener.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,3 +52,20 @@ app.add_middleware(
 app.include_router(auth_router)
 app.include_router(feed_router)
 app.include_router(analysis_router)
+app.include_router(document_router)
+
+
+@app.get("/health")
+async def health():
+    from models.models import load_times, loaded
+    from rag.generation import get_generation_service, is_generation_service_loaded
+
+    # модель не загружаем ради проверки здоровья
+    models = {"loaded": loaded(), "load_times": load_times}
+    if not is_generation_service_loaded():
+        return {"status": "ok", "models": models, "generator": None}
+    return {
+        "status": "ok",
+        "models": models,
+        "generator": get_generation_service().health(),
+    }
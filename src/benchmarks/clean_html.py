@@ -0,0 +1,69 @@
+"""Speed and agreement of parse_html and clean_html_batch.
+
+Cleans a corpus of RSS summaries (JSON string per line,
+benchmarks/data/rss_summaries.jsonl by default, or summaries of live feeds
+with --urls) with BeautifulSoup one by one and with the batch cleaner,
+reports fragments per second and fragments where results differ.
+Run from `src`:
+
+    python -m benchmarks.clean_html [--corpus file.jsonl | --urls URL ...]
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import feedparser
+
+from utils import _clean_html_fragment, clean_html_batch, parse_html
+
+DEFAULT_CORPUS = Path(__file__).parent / "data" / "rss_summaries.jsonl"
+
+
+def load_corpus(path: Path, urls: list[str]) -> list[str]:
+    if urls:
+        return [
+            entry.summary
+            for url in urls
+            for entry in feedparser.parse(url)["entries"]
+            if "summary" in entry
+        ]
+    return [json.loads(line) for line in path.read_text().splitlines() if line]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--urls", nargs="*", default=[])
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.urls)
+    values = corpus * args.repeat
+
+    started = time.perf_counter()
+    expected = [parse_html(fragment) for fragment in values]
+    soup_rate = len(values) / (time.perf_counter() - started)
+
+    _clean_html_fragment.cache_clear()
+    started = time.perf_counter()
+    clean_html_batch(corpus)
+    cold_rate = len(corpus) / (time.perf_counter() - started)
+    started = time.perf_counter()
+    actual = clean_html_batch(values)
+    warm_rate = len(values) / (time.perf_counter() - started)
+
+    print(f"corpus: {len(corpus)} fragments, {len(values)} cleaned")
+    print(f"parse_html:               {soup_rate:10.0f} fragments/s")
+    print(f"clean_html_batch (cold):  {cold_rate:10.0f} fragments/s")
+    print(f"clean_html_batch (warm):  {warm_rate:10.0f} fragments/s")
+    for fragment, old, new in zip(corpus, expected, actual):
+        if old != new:
+            print(f"differs: {fragment[:60]!r}")
+            print(f"  parse_html: {old!r}")
+            print(f"  batch:      {new!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Throughput and parity of PyTorch and ONNX Runtime embedding backends on CPU.
+
+Embeds the same synthetic texts with both engines, reports texts per second
+and min cosine similarity of the outputs. Exits with code 1 if similarity is
+below the tolerance. Run from `src`:
+
+    python -m benchmarks.embedding_backends [--texts 512] [--tolerance 0.99]
+"""
+
+import argparse
+import sys
+import time
+
+from crawler.onnx_engine import OnnxEmbeddingEngine, parity
+from crawler.processor import EmbeddingEngine
+from models.models import get_embedder, get_embedding_tokenizer
+
+SENTENCES = [
+    "Центральный банк сохранил ключевую ставку на прежнем уровне.",
+    "The company reported record quarterly revenue and raised its forecast.",
+    "В регионе ожидаются сильные дожди и порывистый ветер.",
+    "Researchers published a new method for protein structure prediction.",
+]
+
+
+def throughput(engine: EmbeddingEngine, texts: list[str]) -> float:
+    engine.embed(texts[:8])  # прогрев
+    started = time.perf_counter()
+    engine.embed(texts)
+    return len(texts) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--tolerance", type=float, default=0.99)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    tokenizer, model = get_embedding_tokenizer(), get_embedder()
+    # тексты разной длины, как заголовки и описания статей
+    texts = [
+        " ".join(SENTENCES[j % len(SENTENCES)] for j in range(i % 6 + 1))
+        for i in range(args.texts)
+    ]
+    engines = {
+        "torch": EmbeddingEngine(tokenizer=tokenizer, model=model, device="cpu"),
+        "onnx": OnnxEmbeddingEngine(
+            tokenizer, model, quantize=False, threads=args.threads
+        ),
+        "onnx-int8": OnnxEmbeddingEngine(
+            tokenizer, model, quantize=True, threads=args.threads
+        ),
+    }
+    failed = False
+    for name, engine in engines.items():
+        similarity = parity(engines["torch"], engine, texts[:64])
+        failed |= similarity < args.tolerance
+        print(
+            f"{name:<10} {throughput(engine, texts):8.1f} texts/s, "
+            f"min cosine to torch {similarity:.4f}"
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
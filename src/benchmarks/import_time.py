@@ -0,0 +1,108 @@
+"""Cold start benchmark of the API and CLI entry points.
+
+Every target is imported in a fresh interpreter with `python -X importtime`,
+the report is summed per top-level package. Run from `src`:
+
+    python -m benchmarks.import_time [--budget-ms 1500] [--top 15] [targets...]
+
+Exits with code 1 if any target exceeds its budget.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import Counter
+
+# цель -> модуль, который импортирует соответствующая команда
+TARGETS = {
+    "api": "backend.main",
+    "cli": "app",
+    "import-data": "crawler.rss_crawler",
+    "process-data": "rag.processor",
+    "reembed": "crawler.reembed",
+    "worker": "backend.job.worker",
+    "scheduler": "backend.job.scheduler",
+}
+# бюджеты в миллисекундах, переопределяются IMPORT_BUDGET_MS_<TARGET>
+BUDGETS_MS = {
+    "api": 3000,
+    "cli": 500,
+    "import-data": 3000,
+    "process-data": 3000,
+    "reembed": 3000,
+    "worker": 1500,
+    "scheduler": 1500,
+}
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str) -> tuple[int, Counter, str]:
+    """Imports module in a fresh interpreter
+
+    Args:
+        module (str): module to import
+
+    Returns:
+        tuple[int, Counter, str]: total microseconds, self time per top-level
+        package and stderr if the import failed
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    total = 0
+    packages = Counter()
+    errors = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            if not line.startswith("import time:"):
+                errors.append(line)
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        packages[name.split(".")[0]] += int(self_us)
+        # верхний уровень вложенности -- модули, импортированные напрямую
+        if len(indent) == 1:
+            total += int(cumulative_us)
+    return total, packages, "\n".join(errors) if result.returncode else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("targets", nargs="*", default=list(TARGETS))
+    parser.add_argument("--budget-ms", type=float, help="Budget of every target")
+    parser.add_argument("--top", type=int, default=10, help="Packages to show")
+    args = parser.parse_args()
+
+    exceeded = []
+    for target in args.targets:
+        module = TARGETS.get(target, target)
+        total, packages, error = measure(module)
+        budget = args.budget_ms or float(
+            os.getenv(
+                f"IMPORT_BUDGET_MS_{target.upper().replace('-', '_')}",
+                BUDGETS_MS.get(target, 1000),
+            )
+        )
+        status = "ok" if total / 1000 <= budget else "over budget"
+        print(
+            f"{target} ({module}): {total / 1000:.0f} ms, "
+            f"budget {budget:.0f} ms, {status}"
+        )
+        if error:
+            print(f"  import failed:\n{error}")
+        for name, self_us in packages.most_common(args.top):
+            print(f"  {name:<24} {self_us / 1000:8.1f} ms")
+        if status != "ok" or error:
+            exceeded.append(target)
+
+    sys.exit(1 if exceeded else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Speed and agreement of the fast and the slow date parsers.
+
+Parses a corpus of feed dates (one per line, benchmarks/data/feed_dates.txt
+by default) with the old dateutil/delorean path and with parse_time,
+reports dates per second, the fallback rate and strings where results
+differ. Run from `src`:
+
+    python -m benchmarks.parse_time [--corpus dates.txt] [--repeat 200]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from utils import _parse_time_cached, _parse_time_slow, parse_time, parse_time_stats
+
+DEFAULT_CORPUS = Path(__file__).parent / "data" / "feed_dates.txt"
+
+
+def rate(parse, values: list[str]) -> float:
+    started = time.perf_counter()
+    for ts in values:
+        try:
+            parse(ts)
+        except (ValueError, OverflowError):
+            pass
+    return len(values) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = [line.strip() for line in args.corpus.read_text().splitlines()]
+    corpus = [line for line in corpus if line]
+    values = corpus * args.repeat
+
+    mismatches = []
+    for ts in corpus:
+        try:
+            expected = _parse_time_slow(ts)
+        except (ValueError, OverflowError):
+            continue
+        if parse_time(ts) != expected:
+            mismatches.append((ts, expected, parse_time(ts)))
+
+    slow = rate(_parse_time_slow, values)
+    _parse_time_cached.cache_clear()
+    # первый проход без кэша, дальше даты повторяются, как при опросе фидов
+    cold = rate(parse_time, corpus)
+    warm = rate(parse_time, values)
+
+    stats = parse_time_stats()
+    print(f"corpus: {len(corpus)} distinct dates, {len(values)} parsed")
+    print(f"slow path:         {slow:12.0f} dates/s")
+    print(f"parse_time (cold): {cold:12.0f} dates/s")
+    print(f"parse_time (warm): {warm:12.0f} dates/s")
+    print(f"fallback rate:     {stats['fallback_rate']:.1%}")
+    for ts, expected, actual in mismatches:
+        print(f"mismatch: {ts!r}: slow {expected}, fast {actual}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Retrieval quality of the configured embedding model.
+
+Descriptions of stored articles are used as queries and titles as the
+corpus: a query is a hit if the title of the same article is among the
+top-k most similar titles. Reports recall@k, MRR and embedding throughput,
+so embedding models and pooling settings can be compared. Run from `src`:
+
+    python -m benchmarks.retrieval_quality [--limit 2000] [--k 1 5 10]
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from backend.database.database import async_session_maker
+from backend.database.models import Article
+from crawler.processor import get_embeddings
+from models.models import get_device, get_embedder, get_embedding_tokenizer
+
+
+async def load_pairs(limit: int) -> tuple[list[str], list[str]]:
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(Article.title, Article.description)
+            .where(Article.description.is_not(None), Article.description != "")
+            .order_by(Article.article_id.desc())
+            .limit(limit)
+        )
+        rows = result.all()
+    return [row.title for row in rows], [row.description for row in rows]
+
+
+def embed(texts: list[str]) -> tuple[np.ndarray, float]:
+    started = time.perf_counter()
+    embeddings, _ = get_embeddings(
+        tokenizer=get_embedding_tokenizer(),
+        model=get_embedder(),
+        device=get_device(),
+        df=pd.DataFrame({"text": texts}),
+        col_name="text",
+        use_cache=False,
+    )
+    elapsed = time.perf_counter() - started
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=2000, help="Articles to use")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    args = parser.parse_args()
+
+    titles, descriptions = asyncio.run(load_pairs(args.limit))
+    if not titles:
+        print("No articles with descriptions found.")
+        return
+    corpus, corpus_time = embed(titles)
+    queries, query_time = embed(descriptions)
+
+    scores = queries @ corpus.T
+    # место правильного заголовка среди всех заголовков, 1 -- лучший
+    ranks = (scores > scores.diagonal()[:, None]).sum(axis=1) + 1
+    print(f"articles: {len(titles)}, dim: {corpus.shape[1]}")
+    print(f"throughput: {2 * len(titles) / (corpus_time + query_time):.1f} texts/s")
+    for k in args.k:
+        print(f"recall@{k}: {(ranks <= k).mean():.3f}")
+    print(f"MRR: {(1 / ranks).mean():.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DIGEST_SIZE = 20  # sha1
+
+
+class DiskTier:
+    def __init__(self, path: Path, dim: int, max_bytes: int):
+        """Fixed-size memory-mapped storage of vectors of one model.
+        Slots are reused in least recently used order when the file is full.
+        The digest of the text is stored next to the vector and checked on read,
+        so a slot overwritten by another process is never returned for a wrong text
+
+        Args:
+            path (Path): directory of the model
+            dim (int): vector dimension
+            max_bytes (int): size limit of the tier
+        """
+        self.path = path
+        self.dim = dim
+        self.capacity = max(1, max_bytes // (dim * 4 + DIGEST_SIZE))
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        vectors_path = self.path / "vectors.f32"
+        digests_path = self.path / "digests.bin"
+        index_path = self.path / "index.json"
+        expected_size = self.capacity * dim * 4
+        # при смене размера или размерности кэш проще начать заново
+        fresh = (
+            not vectors_path.exists()
+            or vectors_path.stat().st_size != expected_size
+            or not digests_path.exists()
+            or not index_path.exists()
+        )
+        mode = "w+" if fresh else "r+"
+        self.vectors = np.memmap(
+            vectors_path, dtype=np.float32, mode=mode, shape=(self.capacity, dim)
+        )
+        self.digests = np.memmap(
+            digests_path, dtype=np.uint8, mode=mode, shape=(self.capacity, DIGEST_SIZE)
+        )
+        # key -> [slot, last access tick]
+        self.index: dict[str, list[int]] = (
+            {} if fresh else json.loads(index_path.read_text())
+        )
+        self.tick = max((t for _, t in self.index.values()), default=0)
+        self.free = sorted(
+            set(range(self.capacity)) - {slot for slot, _ in self.index.values()},
+            reverse=True,
+        )
+        # index.json пишется целиком, поэтому сбрасывается не после каждой пачки
+        self.dirty = 0
+        self.flushed_at = time.monotonic()
+
+    def get(self, key: str) -> np.ndarray | None:
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        slot = entry[0]
+        if bytes(self.digests[slot]) != bytes.fromhex(key):
+            del self.index[key]
+            self.free.append(slot)
+            return None
+        self.tick += 1
+        entry[1] = self.tick
+        return np.array(self.vectors[slot])
+
+    def put(self, key: str, vector: np.ndarray):
+        if key in self.index:
+            slot = self.index[key][0]
+        else:
+            if not self.free:
+                self.evict()
+            slot = self.free.pop()
+        self.tick += 1
+        self.vectors[slot] = vector
+        self.digests[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+        self.index[key] = [slot, self.tick]
+        self.dirty += 1
+
+    def evict(self):
+        """Frees a tenth of the slots, least recently used first"""
+        count = max(1, self.capacity // 10)
+        oldest = sorted(self.index, key=lambda k: self.index[k][1])[:count]
+        for key in oldest:
+            self.free.append(self.index.pop(key)[0])
+
+    def maybe_flush(self, every_puts: int, every_seconds: float):
+        """Flushes after every_puts new vectors or every_seconds since the
+        last flush. Vectors written after the last flush are lost on a crash,
+        an outdated index is safe: digests reject slots reused since then"""
+        if self.dirty and (
+            self.dirty >= every_puts
+            or time.monotonic() - self.flushed_at >= every_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        self.dirty = 0
+        self.flushed_at = time.monotonic()
+        self.vectors.flush()
+        self.digests.flush()
+        tmp_path = self.path / "index.json.tmp"
+        tmp_path.write_text(json.dumps(self.index))
+        os.replace(tmp_path, self.path / "index.json")
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path: str = os.getenv("EMBEDDING_CACHE_DIR", "~/data/embedding_cache"),
+        memory_items: int = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 10000)),
+        disk_mb: int = int(os.getenv("EMBEDDING_CACHE_DISK_MB", 512)),
+        flush_puts: int = int(os.getenv("EMBEDDING_CACHE_FLUSH_PUTS", 4096)),
+        flush_seconds: float = float(os.getenv("EMBEDDING_CACHE_FLUSH_SECONDS", 60)),
+    ):
+        """Content-addressed embedding cache keyed by (model name, normalized text hash)
+        with in-process LRU tier and on-disk memory-mapped tier
+
+        Args:
+            path (str): directory of the on-disk tier, disk tier is off if empty
+            memory_items (int): number of vectors kept in process memory
+            disk_mb (int): size limit of the on-disk tier of every model
+            flush_puts (int): new vectors after which the disk tier is flushed
+            flush_seconds (float): max time between flushes of the disk tier,
+                the tier is also flushed at process exit
+        """
+        self.path = Path(path).expanduser() if path else None
+        self.memory_items = memory_items
+        self.disk_bytes = disk_mb * 1024 * 1024
+        self.flush_puts = flush_puts
+        self.flush_seconds = flush_seconds
+        self.memory: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self.disk: dict[str, DiskTier] = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> str:
+        normalized = " ".join(str(text).split())
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def model_name(model: any) -> str:
+        return getattr(model, "name_or_path", None) or type(model).__name__
+
+    def _disk_tier(self, model_name: str, dim: int) -> DiskTier | None:
+        if self.path is None or self.disk_bytes <= 0:
+            return None
+        if model_name not in self.disk:
+            safe_name = re.sub(r"[^\w.-]+", "_", model_name)
+            self.disk[model_name] = DiskTier(
+                self.path / f"{safe_name}-{dim}", dim, self.disk_bytes
+            )
+        return self.disk[model_name]
+
+    def lookup(
+        self, model_name: str, keys: list[str], dim: int
+    ) -> tuple[np.ndarray, list[int]]:
+        """Returns matrix with cached vectors filled in and positions of missing ones"""
+        embeddings = np.empty((len(keys), dim), dtype=np.float32)
+        missing = []
+        with self.lock:
+            disk = self._disk_tier(model_name, dim)
+            for i, key in enumerate(keys):
+                vector = self.memory.get((model_name, key))
+                if vector is not None:
+                    self.memory.move_to_end((model_name, key))
+                    self.counters["memory_hits"] += 1
+                else:
+                    vector = disk.get(key) if disk is not None else None
+                    if vector is None:
+                        self.counters["misses"] += 1
+                        missing.append(i)
+                        continue
+                    self.counters["disk_hits"] += 1
+                    self._remember(model_name, key, vector)
+                embeddings[i] = vector
+        return embeddings, missing
+
+    def store(self, model_name: str, keys: list[str], vectors: np.ndarray):
+        with self.lock:
+            disk = self._disk_tier(model_name, vectors.shape[1])
+            for key, vector in zip(keys, vectors):
+                self._remember(model_name, key, vector)
+                if disk is not None:
+                    disk.put(key, vector)
+            if disk is not None:
+                disk.maybe_flush(self.flush_puts, self.flush_seconds)
+
+    def flush(self):
+        with self.lock:
+            for disk in self.disk.values():
+                if disk.dirty:
+                    disk.flush()
+
+    def _remember(self, model_name: str, key: str, vector: np.ndarray):
+        self.memory[(model_name, key)] = vector
+        self.memory.move_to_end((model_name, key))
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> dict[str, int | float]:
+        """Hit and miss counters since the process start"""
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        total = hits + self.counters["misses"]
+        return {
+            "memory_hits": self.counters["memory_hits"],
+            "disk_hits": self.counters["disk_hits"],
+            "misses": self.counters["misses"],
+            "hit_rate": hits / total if total else 0.0,
+            "memory_items": len(self.memory),
+        }
+
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache | None:
+    """Process-wide cache instance, EMBEDDING_CACHE=off disables caching"""
+    if os.getenv("EMBEDDING_CACHE", "on").lower() in ("0", "off", "false"):
+        return None
+    cache = EmbeddingCache()
+    atexit.register(cache.flush)
+    return cache
@@ -0,0 +1,118 @@
+import asyncio
+import os
+from dataclasses import dataclass
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+USER_AGENT = "source-analyzer/0.1 (+rss crawler)"
+
+
+@dataclass
+class FetchResult:
+    feed: any
+    status: int
+    content: bytes | None = None
+    error: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.content is not None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+class FeedFetcher:
+    def __init__(
+        self,
+        max_connections: int = int(os.getenv("CRAWLER_MAX_CONNECTIONS", 64)),
+        max_per_host: int = int(os.getenv("CRAWLER_MAX_PER_HOST", 4)),
+        timeout: float = float(os.getenv("CRAWLER_TIMEOUT", 20)),
+        retries: int = int(os.getenv("CRAWLER_RETRIES", 2)),
+        backoff: float = float(os.getenv("CRAWLER_BACKOFF", 0.5)),
+    ):
+        """Concurrent HTTP client for RSS feeds
+
+        Args:
+            max_connections (int): global limit of simultaneous connections
+            max_per_host (int): limit of simultaneous connections to a single host
+            timeout (float): total timeout of a single request in seconds
+            retries (int): how many times a failed request is repeated
+            backoff (float): base delay between retries, doubled on every attempt
+        """
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+    async def fetch_all(self, feeds) -> list[FetchResult]:
+        """Downloads all feeds concurrently, so the total time is bounded
+        by the slowest feed rather than the sum of all of them
+
+        Args:
+            feeds (list[Feed]): feeds with `url` attribute
+
+        Returns:
+            list[FetchResult]: results in the same order as feeds
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections, limit_per_host=self.max_per_host
+        )
+        async with aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={"User-Agent": USER_AGENT},
+        ) as session:
+            return await asyncio.gather(
+                *(self.fetch(session, feed) for feed in feeds)
+            )
+
+    @staticmethod
+    def conditional_headers(feed) -> dict[str, str]:
+        """Builds conditional GET headers from validators saved on the previous poll"""
+        headers = {}
+        if getattr(feed, "etag", None):
+            headers["If-None-Match"] = feed.etag
+        if getattr(feed, "last_modified", None):
+            headers["If-Modified-Since"] = feed.last_modified
+        return headers
+
+    async def fetch(self, session: aiohttp.ClientSession, feed) -> FetchResult:
+        """Downloads a single feed with retries on network errors and 5xx responses.
+        If the feed has not changed since the previous poll, server answers 304
+        and the body is not downloaded at all"""
+        headers = self.conditional_headers(feed)
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                async with session.get(feed.url, headers=headers) as response:
+                    # ошибки сервера имеет смысл повторить, ошибки клиента -- нет
+                    if response.status >= 500:
+                        error = f"HTTP {response.status}"
+                        continue
+                    if response.status == 304:
+                        return FetchResult(feed, response.status)
+                    if response.status != 200:
+                        return FetchResult(
+                            feed, response.status, error=f"HTTP {response.status}"
+                        )
+                    content = await response.read()
+                    return FetchResult(
+                        feed,
+                        response.status,
+                        content,
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+        return FetchResult(feed, 0, error=error)
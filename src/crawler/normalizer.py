@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+import feedparser
+from dotenv import load_dotenv
+from mmh3 import hash as mmh3_hash
+
+from utils import clean_html_batch, parse_times
+
+load_dotenv()
+
+COLUMNS = ["article_id", "title", "link", "pub_date", "description", "content_hash"]
+
+
+def normalize_feed(content: bytes) -> tuple[dict[str, list], int]:
+    """Parses raw feed and normalizes its entries: ids, cleaned descriptions,
+    publication dates and content hashes. Runs in a worker, so it takes
+    and returns only picklable values
+
+    Args:
+        content (bytes): body of the feed response
+
+    Returns:
+        tuple[dict[str, list], int]: columns of COLUMNS, one value per valid
+        entry, and the number of dates parsed by the slow path
+    """
+    entries = feedparser.parse(content)["entries"]
+    columns = {name: [] for name in COLUMNS}
+    published, summaries = [], []
+    for entry in entries:
+        # "title", "published" are obligatory fields
+        if "title" not in entry or "published" not in entry:
+            continue
+        columns["article_id"].append(mmh3_hash(entry.title, seed=43))
+        columns["title"].append(entry.title)
+        columns["link"].append(entry.get("link", "missing"))
+        published.append(entry.published)
+        summaries.append(entry.get("summary"))
+
+    # описания и даты обрабатываются колонкой целиком
+    cleaned = clean_html_batch([summary or "" for summary in summaries])
+    columns["description"] = [
+        text if summary is not None else "missing"
+        for summary, text in zip(summaries, cleaned)
+    ]
+    columns["content_hash"] = [
+        mmh3_hash(f"{title}\n{description}", seed=43)
+        for title, description in zip(columns["title"], columns["description"])
+    ]
+    columns["pub_date"], fallbacks = parse_times(published)
+    return columns, fallbacks
+
+
+@lru_cache(maxsize=1)
+def get_executor(
+    kind: str = os.getenv("CRAWLER_EXECUTOR", "process"),
+    workers: int = int(os.getenv("CRAWLER_WORKERS", 0)) or os.cpu_count(),
+) -> Executor | None:
+    """Process-wide executor for feed normalization, kept between imports.
+    `process` uses all cores, `thread` relies on lxml and feedparser
+    releasing the GIL in parsing, `inline` runs on the event loop thread.
+    Processes are started by a fork server: forking the API or a worker
+    directly would copy its threads' locks and loaded models
+
+    Args:
+        kind (str): process, thread or inline
+        workers (int): number of workers, defaults to the number of cores
+
+    Returns:
+        Executor | None: executor or None for inline normalization
+    """
+    if kind == "inline":
+        return None
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    method = (
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    )
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        # сервер один раз импортирует feedparser и lxml, процессы пула
+        # получают их уже загруженными
+        context.set_forkserver_preload(["crawler.normalizer"])
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def _normalize_feed_safe(content: bytes) -> tuple[dict[str, list], int] | Exception:
+    try:
+        return normalize_feed(content)
+    except Exception as e:
+        return e
+
+
+async def normalize_feeds(
+    contents: list[bytes],
+) -> list[tuple[dict[str, list], int] | Exception]:
+    """Normalizes many feeds in parallel, one feed per task. A feed that
+    fails to normalize does not stop the others: its error is returned
+    in its place
+
+    Args:
+        contents (list[bytes]): bodies of the feed responses
+
+    Returns:
+        list[tuple[dict[str, list], int] | Exception]: columns and date
+        fallbacks of every feed or its error, in the same order
+    """
+    executor = get_executor()
+    if executor is None:
+        return [_normalize_feed_safe(content) for content in contents]
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, normalize_feed, content)
+            for content in contents
+        ),
+        return_exceptions=True,
+    )
@@ -0,0 +1,193 @@
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .embedding_cache import EmbeddingCache
+from .processor import EmbeddingEngine
+
+load_dotenv()
+
+# тексты для проверки совпадения ONNX и PyTorch при создании движка
+PARITY_TEXTS = [
+    "Центральный банк сохранил ключевую ставку.",
+    "The company reported record quarterly revenue.",
+    "Погода на выходных: дожди и похолодание до +5.",
+    "A short one.",
+]
+
+
+class OnnxEmbeddingEngine(EmbeddingEngine):
+    def __init__(
+        self,
+        tokenizer: any,
+        model: any,
+        path: str = os.getenv("EMBEDDING_ONNX_DIR", "~/data/onnx"),
+        quantize: bool = (
+            os.getenv("EMBEDDING_ONNX_INT8", "on").lower() not in ("0", "off", "false")
+        ),
+        threads: int = int(os.getenv("EMBEDDING_ONNX_THREADS", 0)),
+        **kwargs,
+    ):
+        """CPU embedding engine on ONNX Runtime. The PyTorch model is exported
+        to ONNX once, optionally with dynamic int8 quantization of weights,
+        and the files are reused by later runs. Tokenization, batching and
+        pooling are the same as in EmbeddingEngine
+
+        Args:
+            tokenizer (any): tokenizer of the embedding model
+            model (any): PyTorch embedding model to export
+            path (str): directory for exported models
+            quantize (bool): quantize weights to int8
+            threads (int): intra-op threads, 0 lets ONNX Runtime decide
+        """
+        super().__init__(tokenizer=tokenizer, model=model, device="cpu", **kwargs)
+        import onnxruntime
+
+        self.quantize = quantize
+        safe_name = re.sub(r"[^\w.-]+", "_", EmbeddingCache.model_name(model))
+        self.path = Path(path).expanduser() / safe_name
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            str(self.export()), options, providers=["CPUExecutionProvider"]
+        )
+
+    @property
+    def name(self) -> str:
+        # квантованные векторы немного отличаются, кэшируем их отдельно
+        return f"{super().name}:onnx{'-int8' if self.quantize else ''}"
+
+    def export(self) -> Path:
+        """Exports the model to ONNX (and int8) if not exported yet
+
+        Returns:
+            Path: path of the model to run
+        """
+        import torch
+
+        fp32_path = self.path / "model.onnx"
+        int8_path = self.path / "model.int8.onnx"
+        target = int8_path if self.quantize else fp32_path
+        if target.exists():
+            return target
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        if not fp32_path.exists():
+            model = self.model
+
+            class LastHiddenState(torch.nn.Module):
+                def forward(self, input_ids, attention_mask):
+                    return model(
+                        input_ids=input_ids, attention_mask=attention_mask
+                    ).last_hidden_state
+
+            model.to("cpu")
+            model.eval()
+            dummy = self.tokenizer(["export"], return_tensors="pt")
+            tmp_path = self.path / "model.tmp.onnx"
+            torch.onnx.export(
+                LastHiddenState(),
+                (dummy["input_ids"], dummy["attention_mask"]),
+                str(tmp_path),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                },
+                opset_version=17,
+            )
+            os.replace(tmp_path, fp32_path)
+
+        if self.quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp_path = self.path / "model.int8.tmp.onnx"
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        return target
+
+    def prepare(self):
+        pass
+
+    def forward(self, batch_ids: list[list[int]]) -> np.ndarray:
+        import torch
+
+        batch = self.tokenizer.pad(
+            {"input_ids": batch_ids}, padding=True, return_tensors="np"
+        )
+        attention_mask = batch["attention_mask"].astype(np.int64)
+        (last_hidden_state,) = self.session.run(
+            ["last_hidden_state"],
+            {
+                "input_ids": batch["input_ids"].astype(np.int64),
+                "attention_mask": attention_mask,
+            },
+        )
+        return self.pool(
+            torch.from_numpy(last_hidden_state), torch.from_numpy(attention_mask)
+        )
+
+
+def parity(
+    reference: EmbeddingEngine, candidate: EmbeddingEngine, texts: list[str] = None
+) -> float:
+    """Min cosine similarity between embeddings of two engines on the same texts"""
+    texts = texts or PARITY_TEXTS
+    a = reference.embed(texts)
+    b = candidate.embed(texts)
+    a /= np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b /= np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return float((a * b).sum(axis=1).min())
+
+
+_engines: dict[int, EmbeddingEngine | None] = {}
+
+
+def get_onnx_engine(
+    tokenizer: any,
+    model: any,
+    tolerance: float = float(os.getenv("EMBEDDING_ONNX_TOLERANCE", 0.99)),
+) -> EmbeddingEngine | None:
+    """Returns ONNX engine of the model, created once per process.
+    The engine is checked against the PyTorch model: if min cosine similarity
+    is below tolerance, ONNX Runtime is not installed or the export fails,
+    None is returned and the caller falls back to PyTorch
+
+    Args:
+        tokenizer (any): tokenizer of the embedding model
+        model (any): PyTorch embedding model
+        tolerance (float, optional): min cosine similarity to PyTorch output
+
+    Returns:
+        EmbeddingEngine | None: ONNX engine or None
+    """
+    if id(model) in _engines:
+        return _engines[id(model)]
+    engine = None
+    try:
+        candidate = OnnxEmbeddingEngine(tokenizer, model)
+        similarity = parity(
+            EmbeddingEngine(tokenizer=tokenizer, model=model, device="cpu"), candidate
+        )
+        if similarity >= tolerance:
+            engine = candidate
+        else:
+            print(
+                f"ONNX embeddings differ from PyTorch (cosine {similarity:.4f} "
+                f"< {tolerance}), using PyTorch."
+            )
+    except ImportError as e:
+        print(f"ONNX Runtime is not available ({e}), using PyTorch.")
+    except Exception as e:
+        # ошибки экспорта, квантизации или запуска сессии не ломают эмбеддинги
+        print(f"ONNX engine failed to start ({e!r}), using PyTorch.")
+    _engines[id(model)] = engine
+    return engine
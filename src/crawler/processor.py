@@ -1,4 +1,148 @@
+import os
+
+import numpy as np
 import pandas as pd
+from dotenv import load_dotenv
+
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+
+load_dotenv()
+
+POOLINGS = ("mean", "cls", "last")
+
+
+class EmbeddingEngine:
+    def __init__(
+        self,
+        tokenizer: any,
+        model: any,
+        device: str,
+        batch_size: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 32)),
+        max_length: int = int(os.getenv("EMBEDDING_MAX_LENGTH", 512)),
+        pooling: str = os.getenv("EMBEDDING_POOLING", "mean"),
+        normalize: bool = (
+            os.getenv("EMBEDDING_NORMALIZE", "on").lower() not in ("0", "off", "false")
+        ),
+    ):
+        """Computes sentence embeddings in micro-batches of texts with similar
+        length, so padding is minimal and peak memory is bounded by batch_size
+
+        Args:
+            tokenizer (any): tokenizer of the embedding model
+            model (any): embedding model
+            device (str): cpu or gpu(cuda)
+            batch_size (int): number of texts in a single forward pass
+            max_length (int): texts are truncated to this number of tokens
+            pooling (str): `mean`, `cls` or `last` token of the last hidden state
+            normalize (bool): scale embeddings to unit length
+        """
+        if pooling not in POOLINGS:
+            raise ValueError(f"Unknown pooling {pooling}, expected one of {POOLINGS}")
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+        # не больше, чем позволяет модель
+        self.max_length = min(
+            max_length,
+            getattr(tokenizer, "model_max_length", max_length) or max_length,
+        )
+        self.pooling = pooling
+        self.normalize = normalize
+
+    @property
+    def dim(self) -> int:
+        return self.model.config.hidden_size
+
+    @property
+    def name(self) -> str:
+        """Identifies vectors of this engine, used as the embedding cache namespace"""
+        model_name = EmbeddingCache.model_name(self.model)
+        suffix = "-norm" if self.normalize else ""
+        return f"{model_name}:{self.pooling}:{self.max_length}{suffix}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Returns float32 matrix (len(texts), dim) of pooled last hidden states
+
+        Args:
+            texts (list[str]): texts to embed
+
+        Returns:
+            np.ndarray: embeddings in the same order as texts
+        """
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        # токенизируем один раз без паддинга, чтобы узнать длины
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        input_ids = encoded["input_ids"]
+        # длинные тексты идут первыми: нехватка памяти проявится на первом батче
+        order = np.argsort([-len(ids) for ids in input_ids], kind="stable")
+
+        self.prepare()
+        for start in range(0, len(order), self.batch_size):
+            batch_idx = order[start : start + self.batch_size]
+            embeddings[batch_idx] = self.forward([input_ids[i] for i in batch_idx])
+        if self.normalize:
+            embeddings /= np.maximum(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12
+            )
+        return embeddings
+
+    def prepare(self):
+        self.model.to(self.device)
+        self.model.eval()
+
+    def forward(self, batch_ids: list[list[int]]) -> np.ndarray:
+        """Embeds one micro-batch of token ids, returns pooled vectors"""
+        import torch
+
+        batch = self.tokenizer.pad(
+            {"input_ids": batch_ids}, padding=True, return_tensors="pt"
+        ).to(self.device)
+        with torch.inference_mode():
+            outputs = self.model(
+                input_ids=batch["input_ids"],
+                attention_mask=batch["attention_mask"],
+            )
+            return self.pool(outputs.last_hidden_state, batch["attention_mask"])
+
+    def pool(self, last_hidden_state, attention_mask) -> np.ndarray:
+        """Pools token states into one vector per text, padding is excluded by the mask"""
+        import torch
+
+        if self.pooling == "cls":
+            pooled = last_hidden_state[:, 0]
+        elif self.pooling == "last":
+            # паддинг справа: последний настоящий токен стоит перед ним
+            last = attention_mask.sum(dim=1) - 1
+            pooled = last_hidden_state[
+                torch.arange(last_hidden_state.shape[0], device=last.device), last
+            ]
+        else:
+            mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+            summed = (last_hidden_state * mask).sum(dim=1)
+            counts = mask.sum(dim=1).clamp(min=1)
+            pooled = summed / counts
+        return pooled.float().cpu().numpy()
+
+
+def make_engine(
+    tokenizer: any,
+    model: any,
+    device: str,
+    backend: str = os.getenv("EMBEDDING_BACKEND", "torch"),
+) -> EmbeddingEngine:
+    """Returns embedding engine of the backend: `torch` or `onnx` (CPU only,
+    falls back to torch if ONNX Runtime is missing or fails the parity check)"""
+    if backend == "onnx" and device == "cpu":
+        from .onnx_engine import get_onnx_engine
+
+        engine = get_onnx_engine(tokenizer, model)
+        if engine is not None:
+            return engine
+    return EmbeddingEngine(tokenizer=tokenizer, model=model, device=device)
 
 
 # Функция для получения эмбеддингов предложений
@@ -8,46 +152,43 @@ def get_embeddings(
     device: str,
     df: pd.DataFrame,
     col_name: str = "title",
-) -> tuple[pd.DataFrame, int]:
+    use_cache: bool = True,
+) -> tuple[np.ndarray, int]:
     """get dataframe with column {col_name}, gets embeddings
-    on all entries and returns dataframe with embeddings
+    on all entries and returns them with the embedding dimension.
+    Texts already embedded by the same model are taken from the embedding cache
 
     Args:
         device (str): cpu or gpu(cuda)
         model (any): embedding model
         df (pd.DataFrame): dataframe with columns to get embedding from
         col_name (str, optional): column name of dataframe. Defaults to "title".
+        use_cache (bool, optional): consult the embedding cache. Defaults to True.
 
     Returns:
-        pd.DataFrame: processed dataframe with embeddings column
+        tuple[np.ndarray, int]: float32 embeddings (one row per entry) and dimension
     """
-    import torch
-
     if col_name in df.columns:
-        # Токенизация и получение эмбеддингов
-        inputs = tokenizer(
-            df[col_name].to_list(),
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-            max_length=1024,
-        ).to(device)
+        texts = df[col_name].to_list()
     else:
         # case when a single column with no column name is passed
-        inputs = tokenizer(
-            df[0].to_list(),
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-            max_length=1024,
-        ).to(device)
-
-    with torch.no_grad():
-        model.to(device)
-        outputs = model(**inputs, output_hidden_states=True)
-    # Используем скрытые состояния последнего слоя
-    last_hidden_states = outputs.hidden_states[-1]
-    # Усредняем по токенам для получения одного вектора для каждого предложения
-    embeddings = last_hidden_states.mean(dim=1).cpu()
-    shape = embeddings[0].numpy().shape[0]
-    return embeddings, shape
+        texts = df[0].to_list()
+
+    engine = make_engine(tokenizer, model, device)
+    cache = get_embedding_cache() if use_cache else None
+    if cache is None:
+        embeddings = engine.embed(texts)
+        return embeddings, embeddings.shape[1]
+
+    model_name = engine.name
+    keys = [cache.key(text) for text in texts]
+    embeddings, missing = cache.lookup(model_name, keys, engine.dim)
+    if missing:
+        # одинаковые тексты внутри пачки считаем один раз
+        unique = {keys[i]: i for i in missing}
+        computed = engine.embed([texts[i] for i in unique.values()])
+        cache.store(model_name, list(unique), computed)
+        positions = {key: row for row, key in enumerate(unique)}
+        for i in missing:
+            embeddings[i] = computed[positions[keys[i]]]
+    return embeddings, embeddings.shape[1]
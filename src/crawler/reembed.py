@@ -0,0 +1,67 @@
+import os
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from backend.dao.article_dao import ArticlesDAO
+from backend.document.document_dao import DocumentsDAO
+
+from .processor import get_embeddings
+
+load_dotenv()
+
+# таблица -> колонка, по которой считается эмбеддинг
+SOURCES = {
+    "articles": (ArticlesDAO, "title"),
+    "documents": (DocumentsDAO, "content"),
+}
+
+
+async def reembed(args, tokenizer=None, embedding_model=None, device=None) -> int:
+    """Recomputes stored embeddings with the configured embedding model.
+    Run it after changing EMBEDDING_MODEL_NAME (and EMBEDDING_DIM with
+    the migration), rows are processed in pages ordered by id
+
+    Args:
+        args: `tables`, `page_size` and `only_missing` options
+
+    Returns:
+        int: number of updated rows
+    """
+    from models.models import get_device, get_embedder, get_embedding_tokenizer
+
+    tokenizer = tokenizer or get_embedding_tokenizer()
+    embedding_model = embedding_model or get_embedder()
+    device = device or get_device()
+    page_size = getattr(args, "page_size", None) or int(
+        os.getenv("REEMBED_PAGE_SIZE", 256)
+    )
+    only_missing = getattr(args, "only_missing", False)
+
+    total = 0
+    for table in getattr(args, "tables", None) or list(SOURCES):
+        dao, text_column = SOURCES[table]
+        after_id = done = 0
+        while True:
+            page = await dao.find_embedding_page(
+                text_column, after_id, page_size, only_missing
+            )
+            if not page:
+                break
+            ids = [row_id for row_id, _ in page]
+            embeddings, _ = get_embeddings(
+                tokenizer=tokenizer,
+                model=embedding_model,
+                device=device,
+                df=pd.DataFrame({"text": [text or "" for _, text in page]}),
+                col_name="text",
+            )
+            await dao.update_embeddings(ids, list(embeddings))
+            after_id = ids[-1]
+            done += len(ids)
+            print(f"{table}: {done} rows re-embedded, last id {after_id}")
+        total += done
+    # векторы в памяти процесса посчитаны старой моделью
+    print("Re-embedding complete!")
+    print("Delete VECTOR_INDEX_DIR if the in-memory index is used.")
+    return total
@@ -1,18 +1,20 @@
 from collections import namedtuple
 from datetime import datetime
 
-import feedparser
 import pandas as pd
-from mmh3 import hash as mmh3_hash
 from tqdm import tqdm
 
 from backend.dao.article_dao import ArticlesDAO
-from models.models import device, embedding_model, tokenizer
-from utils import filter_on_publication_date, parse_html, parse_time
+from backend.feed.feed_dao import FeedsDAO
+from utils import filter_on_publication_date
 
+from .fetcher import FeedFetcher
+from .normalizer import COLUMNS, normalize_feeds
 from .processor import get_embeddings
 
-Feed = namedtuple("Feed", ["id", "url"])
+Feed = namedtuple(
+    "Feed", ["id", "url", "etag", "last_modified"], defaults=(None, None)
+)
 
 
 class RSSCrawler:
@@ -24,6 +26,8 @@ class RSSCrawler:
             urls (Set[str]): set of urls to get rss feed form
         """
         self.feeds = [Feed(*item) for item in urls]
+        # feed_id -> (etag, last_modified), сохраняются только после записи статей в БД
+        self.validators: dict[int, tuple[str, str]] = {}
 
     async def parse_rss_feeds(self, feeds) -> pd.DataFrame:
         """Goes through all rss-feeds, gets new articles
@@ -34,78 +38,55 @@ class RSSCrawler:
         """
         dataframes_per_url: list[pd.DataFrame] = []
 
-        for feed in tqdm(feeds, total=len(feeds)):
-            feed_data: list[feedparser.util.FeedParserDict] = feedparser.parse(
-                feed.url
-            )["entries"]
-            if len(feed_data) == 0:
+        # сначала скачиваем все фиды параллельно, разбор идёт уже по готовым байтам
+        results = await FeedFetcher().fetch_all(feeds)
+
+        fetched = []
+        for result in results:
+            feed = result.feed
+            if result.not_modified:
+                print(f"Feed {feed.url} was not modified.")
+                continue
+            if not result.ok:
+                print(f"Failed to fetch {feed.url}: {result.error}")
+                continue
+            fetched.append(result)
+
+        # разбор XML, очистка HTML и даты -- работа для процессора, она идёт в пуле,
+        # чтобы не блокировать цикл событий (и обработчики API)
+        normalized = await normalize_feeds([result.content for result in fetched])
+
+        dates = fallbacks = 0
+        for result, feed_result in tqdm(zip(fetched, normalized), total=len(fetched)):
+            feed = result.feed
+            if isinstance(feed_result, Exception):
+                # валидаторы не сохраняются, фид скачается заново при следующем опросе
+                print(f"Skipped {feed.url} feed: {feed_result!r}")
+                continue
+            columns, feed_fallbacks = feed_result
+            dates += len(columns["pub_date"])
+            fallbacks += feed_fallbacks
+            if not columns["article_id"]:
                 print("Feed was empty.")
-            curr_df: pd.DataFrame = await self.__parse_rss_feed(feed_data)
+                continue
+            curr_df = pd.DataFrame(columns)
+            curr_df["feed_id"] = feed.id
             dataframes_per_url.append(curr_df)
-            print(f"Parsed {feed.url} feed with {len(feed_data)} records.")
-
+            if feed.id is not None and (result.etag or result.last_modified):
+                self.validators[feed.id] = (result.etag, result.last_modified)
+            print(f"Parsed {feed.url} feed with {len(curr_df)} records.")
+
+        if dates:
+            print(
+                f"{fallbacks} of {dates} dates ({fallbacks / dates:.1%}) "
+                "needed the slow date parser."
+            )
+        if not dataframes_per_url:
+            return pd.DataFrame(columns=[*COLUMNS, "feed_id"])
         df = pd.concat(dataframes_per_url).drop_duplicates(subset="article_id")
-        df.set_index("article_id")
-        df["feed_id"] = feed.id
         print(f"Parsed {len(feeds)} feeds with {len(df)} records in total.")
         return df
 
-    @staticmethod
-    async def __parse_rss_feed(
-        feed: list[feedparser.util.FeedParserDict],
-    ) -> pd.DataFrame:
-        """Parses a single RSS feed and fetches titles, sources, publications timestamps and .
-
-        Args:
-            feed (List[feedparser.util.FeedParserDict]):
-            a list of dict, output of feedparser.parse(url)['entries']
-
-        Returns:
-            pd.DataFrame: a Dataframe with title, publication time,
-            link, description and content if exists
-        """
-        ids, parsed_titles, links, pub_dates, descriptions = (
-            [],
-            [],
-            [],
-            [],
-            [],
-        )
-
-        for article_metadata in feed:
-            # "title", "published" are obligatory fields
-            if ("title" not in article_metadata.keys()) or (
-                "published" not in article_metadata.keys()
-            ):
-                continue
-            else:
-                # obligatory fields are there
-                ids.append(mmh3_hash(article_metadata.title, seed=43))
-                parsed_titles.append(article_metadata.title)
-                pub_dates.append(parse_time(article_metadata.published))
-                if "link" in article_metadata.keys():
-                    links.append(article_metadata.link)
-                else:
-                    links.append("missing")
-
-                if "summary" in article_metadata.keys():
-                    descriptions.append(parse_html(article_metadata.summary))
-                else:
-                    descriptions.append("missing")
-
-        print(article_metadata.keys())
-        df = pd.DataFrame(
-            {
-                "article_id": ids,
-                "title": parsed_titles,
-                "link": links,
-                "pub_date": pub_dates,
-                "description": descriptions,
-            }
-        )
-
-        return df
-
     async def update_db(self, df: pd.DataFrame):
         """Writes scraped content into a table
 
@@ -115,6 +96,27 @@ class RSSCrawler:
         """
         await ArticlesDAO().upsert(df)
 
+    @staticmethod
+    async def drop_unchanged(df: pd.DataFrame) -> pd.DataFrame:
+        """Leaves only new articles and articles whose title or description
+        changed since they were embedded, so the embeddings are not recomputed
+
+        Args:
+            df (pd.DataFrame): parsed articles with article_id and content_hash
+
+        Returns:
+            pd.DataFrame: articles which need embedding and upsert
+        """
+        stored = await ArticlesDAO.find_content_hashes(df["article_id"].tolist())
+        if not stored:
+            return df
+        unchanged = [
+            stored.get(article_id) == content_hash
+            for article_id, content_hash in zip(df["article_id"], df["content_hash"])
+        ]
+        print(f"{sum(unchanged)} articles are already embedded.")
+        return df.loc[[not x for x in unchanged]]
+
     async def run(self, tokenizer, model, device):
         # прнимаем запрос от пользователя с url
         # эти url парсим, обрабатываем, а потом обновляем БД
@@ -125,33 +127,39 @@ class RSSCrawler:
             raise ValueError("Model not found")
         # пока используем привязку к сегодняшнему дню, потом можно сделать пользовательскую настройку
         today = datetime.today().strftime("%Y-%m-%d")
-        filtered_df = filter_on_publication_date(df=df, min_date=today).copy()
+        filtered_df = filter_on_publication_date(df=df, min_date=today)
+        filtered_df = (await self.drop_unchanged(filtered_df)).copy()
         count = len(filtered_df)
         if not count:  # Если список пуст
+            await FeedsDAO.update_validators(self.validators)
             return count
-        df_with_embeddings, _ = get_embeddings(
+        embeddings, _ = get_embeddings(
             tokenizer=tokenizer,
             model=model,
             df=filtered_df,
             col_name="title",
             device=device,
         )
-        filtered_df.loc[:, "embeddings"] = list(df_with_embeddings.numpy())
+        filtered_df.loc[:, "embeddings"] = list(embeddings)
         print("data processed")
 
         await self.update_db(filtered_df)
+        await FeedsDAO.update_validators(self.validators)
         print("DB updated!")
         return count
 
 
-async def import_data(
-    args, tokenizer=tokenizer, embedding_model=embedding_model, device=device
-):
-    """creates and runs the crawler"""
+async def import_data(args, tokenizer=None, embedding_model=None, device=None):
+    """creates and runs the crawler, models not passed are taken from the registry"""
+    from models.models import get_device, get_embedder, get_embedding_tokenizer
+
+    tokenizer = tokenizer or get_embedding_tokenizer()
+    embedding_model = embedding_model or get_embedder()
+    device = device or get_device()
     data = getattr(args, "urls", args)
     # async with async_session_maker() as session:
     crawler = RSSCrawler(data)
-    await crawler.run(tokenizer, embedding_model, device)
+    return await crawler.run(tokenizer, embedding_model, device)
 
 
 # if __name__ == "__main__":
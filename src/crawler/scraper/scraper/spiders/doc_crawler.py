@@ -1,6 +1,14 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
 import scrapy
 from scrapy.crawler import CrawlerProcess
 
+# каталог src, из него запускается дочерний процесс краулера
+SRC_DIR = Path(__file__).resolve().parents[4]
+
 
 class DocumentsSpider(scrapy.Spider):
     name = "documents"
@@ -18,8 +26,11 @@ class DocumentsSpider(scrapy.Spider):
 
 
 def import_data(urls):
+    """Crawls the pages and returns their text. Blocks until the crawl ends
+    and can run only once per process (the Twisted reactor is not restartable),
+    so servers and workers should use `scrape_documents`"""
     results = []
-    process = CrawlerProcess()
+    process = CrawlerProcess(settings={"LOG_LEVEL": "ERROR"})
     process.crawl(
         DocumentsSpider,
         urls=urls,
@@ -27,3 +38,38 @@ def import_data(urls):
     )
     process.start()
     return results
+
+
+async def scrape_documents(urls: list[str], timeout: float = 120) -> list[str]:
+    """Runs the crawl in a separate Python process without blocking the event loop
+
+    Args:
+        urls (list[str]): pages to crawl
+        timeout (float, optional): seconds to wait for the crawl
+
+    Returns:
+        list[str]: text of every crawled page
+    """
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "crawler.scraper.scraper.spiders.doc_crawler",
+        *urls,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=SRC_DIR,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise ValueError(f"Scraping {urls} timed out after {timeout}s")
+    if process.returncode != 0:
+        raise ValueError(f"Scraping {urls} failed: {stderr.decode()[-1000:]}")
+    return json.loads(stdout)
+
+
+if __name__ == "__main__":
+    # результат уходит родительскому процессу через stdout
+    print(json.dumps(import_data(sys.argv[1:]), ensure_ascii=False))
@@ -0,0 +1,61 @@
+"""vector_indexes
+
+Revision ID: 9c4e7d2a1f38
+Revises: 5e21c4a8b9d0
+Create Date: 2025-05-06 19:03:52.114807
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import pgvector
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e7d2a1f38'
+down_revision: Union[str, None] = '5e21c4a8b9d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # индексы строятся CONCURRENTLY, чтобы не блокировать запись статей,
+    # а это возможно только вне транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_articles_embeddings_hnsw',
+            'articles',
+            ['embeddings'],
+            unique=False,
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'embeddings': 'vector_cosine_ops'},
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_documents_embeddings_hnsw',
+            'documents',
+            ['embeddings'],
+            unique=False,
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'embeddings': 'vector_cosine_ops'},
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_documents_embeddings_hnsw',
+            table_name='documents',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_articles_embeddings_hnsw',
+            table_name='articles',
+            postgresql_concurrently=True,
+        )
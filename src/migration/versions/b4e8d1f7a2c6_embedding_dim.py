@@ -0,0 +1,77 @@
+"""embedding_dim
+
+Revision ID: b4e8d1f7a2c6
+Revises: 9c4e7d2a1f38
+Create Date: 2025-05-09 14:27:41.538102
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import pgvector
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e8d1f7a2c6'
+down_revision: Union[str, None] = '9c4e7d2a1f38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# таблица -> HNSW-индекс по её эмбеддингам
+TABLES = {
+    'articles': 'ix_articles_embeddings_hnsw',
+    'documents': 'ix_documents_embeddings_hnsw',
+}
+
+
+def resize_embeddings(dim: int) -> None:
+    """Changes dimension of the embeddings columns. Vectors of another
+    dimension are meaningless for the new model, so they are reset to NULL
+    and have to be recomputed with `app.py reembed --only-missing`"""
+    connection = op.get_bind()
+    for table, index in TABLES.items():
+        current = connection.execute(
+            sa.text(
+                "SELECT atttypmod FROM pg_attribute "
+                "WHERE attrelid = CAST(:table AS regclass) AND attname = 'embeddings'"
+            ),
+            {'table': table},
+        ).scalar()
+        if current == dim:
+            continue
+        op.drop_index(index, table_name=table)
+        op.alter_column(
+            table,
+            'embeddings',
+            type_=pgvector.sqlalchemy.vector.VECTOR(dim=dim),
+            postgresql_using='NULL',
+            existing_nullable=True,
+        )
+        op.create_index(
+            index,
+            table,
+            ['embeddings'],
+            unique=False,
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'embeddings': 'vector_cosine_ops'},
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    The dimension is taken from EMBEDDING_DIM at upgrade time, so the same
+    value must be set for `alembic upgrade` and for the application; the
+    embedder checks the real column type at startup. To change the
+    dimension later set EMBEDDING_DIM, downgrade below this revision and
+    upgrade again, then run `app.py reembed --only-missing`
+    """
+    resize_embeddings(int(os.getenv('EMBEDDING_DIM', 768)))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    resize_embeddings(768)
@@ -1,34 +1,67 @@
 import os
+import threading
+import time
 from functools import lru_cache
 
-import torch
 from dotenv import load_dotenv
-from transformers import (
-    AutoModel,
-    AutoModelForCausalLM,
-    AutoTokenizer,
-    BitsAndBytesConfig,
-)
 
 load_dotenv()
 
+# torch и transformers импортируются только при первой загрузке модели:
+# import-data, API и миграции не должны платить за них при старте
 
-if torch.cuda.is_available():
-    device = "cuda"
-    bnb_config = BitsAndBytesConfig(
+# секунды на загрузку каждой модели, превышение только логируется
+MODEL_LOAD_BUDGETS = {
+    "tokenizer": float(os.getenv("TOKENIZER_LOAD_BUDGET", 10)),
+    "embedding_tokenizer": float(os.getenv("TOKENIZER_LOAD_BUDGET", 10)),
+    "embedder": float(os.getenv("EMBEDDER_LOAD_BUDGET", 60)),
+    "model": float(os.getenv("LLM_LOAD_BUDGET", 300)),
+}
+
+load_times: dict[str, float] = {}
+_lock = threading.RLock()
+
+
+def _timed(name: str, loader):
+    """Runs loader once, records its duration and reports exceeded budget"""
+    started = time.perf_counter()
+    value = loader()
+    load_times[name] = time.perf_counter() - started
+    budget = MODEL_LOAD_BUDGETS.get(name)
+    if budget is not None and load_times[name] > budget:
+        print(
+            f"Loading {name} took {load_times[name]:.1f}s, budget is {budget:.1f}s."
+        )
+    return value
+
+
+@lru_cache(maxsize=1)
+def get_device() -> str:
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def get_quantization_config():
+    import torch
+    from transformers import BitsAndBytesConfig
+
+    if get_device() != "cuda":
+        return None
+    return BitsAndBytesConfig(
         load_in_4bit=True,
         bnb_4bit_use_double_quant=True,
         bnb_4bit_quant_type="nf4",
         bnb_4bit_compute_dtype=torch.float16,
     )
-else:
-    device = "cpu"
-    bnb_config = None
 
 
 # используем кэширование чтобы не инициализировать одну модель дважды при вызове из других модулей
 @lru_cache(maxsize=1)
 def load_tokenizer():
+    from transformers import AutoTokenizer, logging
+
+    logging.set_verbosity_error()
     tokenizer = AutoTokenizer.from_pretrained(
         os.getenv("LLM_MODEL_NAME"),
         token=os.getenv("HF_TOKEN"),
@@ -38,26 +71,194 @@ def load_tokenizer():
 
 
 @lru_cache(maxsize=1)
-def load_embedding_model(tokenizer):
+def load_embedding_tokenizer():
+    from transformers import AutoTokenizer
+
+    # у модели эмбеддингов свой токенизатор, словарь LLM ей не подходит
+    return AutoTokenizer.from_pretrained(
+        os.getenv("EMBEDDING_TOKENIZER_NAME") or os.getenv("EMBEDDING_MODEL_NAME"),
+        token=os.getenv("HF_TOKEN"),
+    )
+
+
+@lru_cache(maxsize=1)
+def load_embedding_model():
+    from transformers import AutoModel
+
     embedding_model = AutoModel.from_pretrained(
         os.getenv("EMBEDDING_MODEL_NAME"),
         token=os.getenv("HF_TOKEN"),
     )
-    embedding_model.resize_token_embeddings(len(tokenizer), mean_resizing=False)
     return embedding_model
 
 
+def find_embedding_column_dims(tables: list[str]) -> dict[str, int]:
+    """Dimensions of the embeddings columns in the database, pgvector keeps
+    the dimension of a vector column in pg_attribute.atttypmod
+
+    Returns:
+        dict[str, int]: table -> dimension, missing tables are skipped
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from utils import get_conn_string
+
+    async def query():
+        # отдельный движок без пула: соединения общего движка привязаны
+        # к event loop приложения, а этот запрос идёт в своём
+        engine = create_async_engine(get_conn_string(), poolclass=NullPool)
+        try:
+            async with engine.connect() as connection:
+                dims = {}
+                for table in tables:
+                    dim = (
+                        await connection.execute(
+                            text(
+                                "SELECT atttypmod FROM pg_attribute "
+                                "WHERE attrelid = to_regclass(:table) "
+                                "AND attname = 'embeddings'"
+                            ),
+                            {"table": table},
+                        )
+                    ).scalar()
+                    if dim is not None:
+                        dims[table] = dim
+                return dims
+        finally:
+            await engine.dispose()
+
+    # модель грузят и из потоков, и из работающего event loop
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(lambda: asyncio.run(query())).result()
+
+
+def check_embedding_dim(embedding_model):
+    """Checks that vectors of the model fit into the pgvector columns of
+    the database and of the ORM models (EMBEDDING_DIM). If the database is
+    unreachable only the ORM models are checked
+
+    Raises:
+        ValueError: dimension of the model differs from the columns
+    """
+    from backend.database.models import Article, Document
+
+    dim = embedding_model.config.hidden_size
+    tables = [table.__tablename__ for table in (Article, Document)]
+    try:
+        column_dims = find_embedding_column_dims(tables)
+    except Exception as e:
+        print(f"Could not read embedding columns from the database: {e}")
+        column_dims = {}
+    for table in (Article, Document):
+        for source, column_dim in (
+            ("EMBEDDING_DIM", table.embeddings.type.dim),
+            ("database", column_dims.get(table.__tablename__, dim)),
+        ):
+            if column_dim != dim:
+                raise ValueError(
+                    f"Embedding model produces {dim}-dimensional vectors, "
+                    f"{table.__tablename__}.embeddings is vector({column_dim}) "
+                    f"in the {source}. Set EMBEDDING_DIM, run the migrations "
+                    "and `app.py reembed`"
+                )
+
+
 @lru_cache(maxsize=1)
 def load_model():
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    torch.random.manual_seed(42)
     model = AutoModelForCausalLM.from_pretrained(
         os.getenv("LLM_MODEL_NAME"),
         token=os.getenv("HF_TOKEN"),
-        quantization_config=bnb_config,
-        device_map=device,
+        quantization_config=get_quantization_config(),
+        device_map=get_device(),
     )
     return model
 
 
-tokenizer = load_tokenizer()
-embedding_model = load_embedding_model(tokenizer)
-model = load_model()
+def get_tokenizer():
+    with _lock:
+        if load_tokenizer.cache_info().currsize:
+            return load_tokenizer()
+        return _timed("tokenizer", load_tokenizer)
+
+
+def get_embedding_tokenizer():
+    with _lock:
+        if load_embedding_tokenizer.cache_info().currsize:
+            return load_embedding_tokenizer()
+        return _timed("embedding_tokenizer", load_embedding_tokenizer)
+
+
+def get_embedder():
+    with _lock:
+        if load_embedding_model.cache_info().currsize:
+            return load_embedding_model()
+        embedding_model = _timed("embedder", load_embedding_model)
+        try:
+            check_embedding_dim(embedding_model)
+        except ValueError:
+            load_embedding_model.cache_clear()
+            raise
+        return embedding_model
+
+
+def get_model():
+    with _lock:
+        if load_model.cache_info().currsize:
+            return load_model()
+        return _timed("model", load_model)
+
+
+def get_generator():
+    """Returns the worker-wide generation service, loads the LLM on first use"""
+    from rag.generation import get_generation_service
+
+    return get_generation_service(get_model(), get_tokenizer())
+
+
+def loaded() -> dict[str, bool]:
+    return {
+        "tokenizer": bool(load_tokenizer.cache_info().currsize),
+        "embedding_tokenizer": bool(load_embedding_tokenizer.cache_info().currsize),
+        "embedder": bool(load_embedding_model.cache_info().currsize),
+        "model": bool(load_model.cache_info().currsize),
+    }
+
+
+def warm_up(components: list[str]):
+    """Loads the listed components (`embedder`, `generator`) and runs a tiny
+    forward pass, so the first real request does not pay for initialisation
+
+    Args:
+        components (list[str]): components to warm up
+    """
+    if "embedder" in components:
+        from crawler.processor import EmbeddingEngine
+
+        EmbeddingEngine(get_embedding_tokenizer(), get_embedder(), get_device()).embed(
+            ["ping"]
+        )
+    if "generator" in components:
+        get_generator().warm_up()
+
+
+def __getattr__(name: str):
+    # совместимость со старым `from models.models import model`: загрузка по обращению
+    accessors = {
+        "device": get_device,
+        "tokenizer": get_tokenizer,
+        "embedding_tokenizer": get_embedding_tokenizer,
+        "embedding_model": get_embedder,
+        "model": get_model,
+    }
+    if name in accessors:
+        return accessors[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,260 @@
+import copy
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rag.prompt import PromptBuilder
+
+load_dotenv()
+
+GENERATION_ARGS = {
+    "max_new_tokens": 200,
+    "return_full_text": False,
+    "do_sample": False,
+}
+# сколько разных префиксов (системный промпт + примеры) держим в памяти
+PREFIX_CACHE_SIZE = 8
+
+
+class GenerationService:
+    def __init__(
+        self,
+        model: any,
+        tokenizer: any,
+        generation_args: dict = None,
+        batch_size: int = int(os.getenv("LLM_BATCH_SIZE", 8)),
+        use_prefix_cache: bool = (
+            os.getenv("LLM_PREFIX_CACHE", "on").lower() not in ("0", "off", "false")
+        ),
+    ):
+        """Long-lived owner of the text-generation pipeline. The pipeline is built
+        once per worker and shared by the CLI and the API routes
+
+        Args:
+            model (any): causal LM
+            tokenizer (any): tokenizer of the LM
+            generation_args (dict, optional): default arguments of generation
+            batch_size (int, optional): number of prompts in a single batch
+            use_prefix_cache (bool, optional): reuse keys/values of the shared prefix
+        """
+        from transformers import pipeline
+
+        self.model = model
+        self.tokenizer = tokenizer
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.generation_args = {**GENERATION_ARGS, **(generation_args or {})}
+        self.batch_size = batch_size
+        self.prompt_builder = PromptBuilder(tokenizer)
+        self.use_prefix_cache = use_prefix_cache
+        self.prefix_caches: OrderedDict[str, tuple] = OrderedDict()
+        self.prefix_hits = 0
+        self.pipe = pipeline("text-generation", model=model, tokenizer=tokenizer)
+        self.warmed_up = False
+        self.requests = 0
+        self.failures = 0
+        self.last_latency: float | None = None
+
+    def generate(self, messages: list[dict[str, str]], **generation_args) -> str:
+        """Generates an answer for a single chat
+
+        Args:
+            messages (list[dict[str, str]]): chat messages with role and content
+
+        Returns:
+            str: generated text without the prompt
+        """
+        if self.use_prefix_cache and len(messages) > 1:
+            return self.generate_batch([messages], **generation_args)[0]
+        started = time.perf_counter()
+        self.requests += 1
+        try:
+            output = self.pipe(messages, **{**self.generation_args, **generation_args})
+        except Exception:
+            self.failures += 1
+            raise
+        self.last_latency = time.perf_counter() - started
+        return output[0]["generated_text"]
+
+    def generate_batch(
+        self, conversations: list[list[dict[str, str]]], **generation_args
+    ) -> list[str]:
+        """Generates answers for many chats. Prompts are sorted by token length
+        and grouped into left-padded batches, so padding stays small.
+        If all chats start with the same messages (system prompt and few-shot
+        examples), keys/values of that prefix are computed once and reused
+
+        Args:
+            conversations (list[list[dict[str, str]]]): chats to answer
+
+        Returns:
+            list[str]: generated texts in the same order as conversations
+        """
+        args = {**self.generation_args, **generation_args}
+        args.pop("return_full_text", None)
+        prompts = [
+            self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            for messages in conversations
+        ]
+        # шаблон чата уже содержит служебные токены
+        input_ids = self.tokenizer(prompts, add_special_tokens=False)["input_ids"]
+
+        prefix = self.prefix_cache(conversations)
+        if prefix is not None and any(
+            ids[: len(prefix[0])] != prefix[0] for ids in input_ids
+        ):
+            # токенизация на границе префикса не совпала -- считаем без кэша
+            prefix = None
+
+        order = np.argsort([len(ids) for ids in input_ids], kind="stable")
+        outputs: list[str | None] = [None] * len(conversations)
+        started = time.perf_counter()
+        self.requests += len(conversations)
+        for start in range(0, len(order), self.batch_size):
+            batch_idx = order[start : start + self.batch_size]
+            try:
+                texts = self._generate_ids(
+                    [input_ids[i] for i in batch_idx], prefix, args
+                )
+            except Exception:
+                self.failures += len(batch_idx)
+                raise
+            for i, text in zip(batch_idx, texts):
+                outputs[i] = text
+        self.last_latency = time.perf_counter() - started
+        return outputs
+
+    def _generate_ids(self, batch_ids: list[list[int]], prefix, args) -> list[str]:
+        import torch
+
+        prefix_ids, prefix_cache = prefix if prefix is not None else ([], None)
+        suffixes = [ids[len(prefix_ids) :] for ids in batch_ids]
+        width = max(len(ids) for ids in suffixes)
+        pad_token_id = self.tokenizer.pad_token_id
+        # для генерации паддинг должен быть слева, иначе ответ продолжит паддинг.
+        # При кэше префикса паддинг стоит между префиксом и остальным текстом,
+        # позиции токенов модель восстанавливает по attention_mask
+        input_ids = [
+            prefix_ids + [pad_token_id] * (width - len(ids)) + ids for ids in suffixes
+        ]
+        attention_mask = [
+            [1] * len(prefix_ids) + [0] * (width - len(ids)) + [1] * len(ids)
+            for ids in suffixes
+        ]
+        input_ids = torch.tensor(input_ids, device=self.model.device)
+        attention_mask = torch.tensor(attention_mask, device=self.model.device)
+
+        if prefix_cache is not None:
+            past_key_values = copy.deepcopy(prefix_cache)
+            if len(batch_ids) > 1:
+                past_key_values.batch_repeat_interleave(len(batch_ids))
+            args = {**args, "past_key_values": past_key_values}
+
+        with torch.inference_mode():
+            generated = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                pad_token_id=pad_token_id,
+                **args,
+            )
+        return self.tokenizer.batch_decode(
+            generated[:, input_ids.shape[1] :], skip_special_tokens=True
+        )
+
+    def prefix_cache(self, conversations: list[list[dict[str, str]]]):
+        """Returns token ids and precomputed keys/values of the messages shared
+        by all conversations (everything before the last message)
+
+        Args:
+            conversations (list[list[dict[str, str]]]): chats to answer
+
+        Returns:
+            tuple[list[int], DynamicCache] | None: prefix ids and its cache
+        """
+        import torch
+
+        if not self.use_prefix_cache or not conversations:
+            return None
+        prefix_messages = conversations[0][:-1]
+        if not prefix_messages or any(
+            messages[:-1] != prefix_messages for messages in conversations
+        ):
+            return None
+
+        prefix_text = self.tokenizer.apply_chat_template(
+            prefix_messages, tokenize=False
+        )
+        key = hashlib.sha1(prefix_text.encode("utf-8")).hexdigest()
+        if key in self.prefix_caches:
+            self.prefix_caches.move_to_end(key)
+            self.prefix_hits += 1
+            return self.prefix_caches[key]
+
+        prefix_ids = self.tokenizer(prefix_text, add_special_tokens=False)["input_ids"]
+        with torch.inference_mode():
+            outputs = self.model(
+                input_ids=torch.tensor([prefix_ids], device=self.model.device),
+                use_cache=True,
+            )
+        self.prefix_caches[key] = (prefix_ids, outputs.past_key_values)
+        while len(self.prefix_caches) > PREFIX_CACHE_SIZE:
+            self.prefix_caches.popitem(last=False)
+        return self.prefix_caches[key]
+
+    def warm_up(self):
+        """Runs a tiny generation so the first real request does not pay
+        for lazy initialisation of kernels and the tokenizer"""
+        if self.warmed_up:
+            return
+        self.generate([{"role": "user", "content": "ping"}], max_new_tokens=1)
+        self.warmed_up = True
+
+    def health(self) -> dict:
+        return {
+            "model": getattr(self.model, "name_or_path", type(self.model).__name__),
+            "device": str(getattr(self.model, "device", "unknown")),
+            "warmed_up": self.warmed_up,
+            "batch_size": self.batch_size,
+            "prefix_caches": len(self.prefix_caches),
+            "prefix_hits": self.prefix_hits,
+            "prompts": self.prompt_builder.stats(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_latency": self.last_latency,
+        }
+
+
+_service: GenerationService | None = None
+
+
+def get_generation_service(model: any = None, tokenizer: any = None):
+    """Returns the worker-wide generation service, creating it on first use.
+    Without arguments the models from `models.models` are used
+
+    Args:
+        model (any, optional): causal LM. Defaults to the shared model.
+        tokenizer (any, optional): tokenizer of the LM. Defaults to the shared one.
+
+    Returns:
+        GenerationService: generation service
+    """
+    global _service
+    if _service is not None and (model is None or _service.model is model):
+        return _service
+    if model is None or tokenizer is None:
+        from models.models import get_model, get_tokenizer
+
+        model = get_model() if model is None else model
+        tokenizer = get_tokenizer() if tokenizer is None else tokenizer
+    _service = GenerationService(model, tokenizer)
+    return _service
+
+
+def is_generation_service_loaded() -> bool:
+    return _service is not None
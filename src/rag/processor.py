@@ -1,94 +1,264 @@
+import asyncio
+import json
+import os
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+import numpy as np
+from dotenv import load_dotenv
+
 from backend.analysis.analysis_dao import AnalysesDAO
 from backend.dao.article_dao import ArticlesDAO
-from backend.database.database import async_session_maker
-from backend.database.models import LLMConnection
+from backend.dao.llm_conn_dao import LLMConnectionsDAO
 from backend.document.document_dao import DocumentsDAO
-from models.models import device, embedding_model, model, tokenizer
-from rag.rag import rag_processing
+from models import models as registry
+from rag.generation import GenerationService, get_generation_service
+from rag.rag import build_feed_prompts, process_document_chunks
 from utils import is_valid_json, remove_json_markdown
 
+load_dotenv()
+
+# сколько статей читается, генерируется и сохраняется за один раз
+PROCESS_PAGE_SIZE = int(os.getenv("PROCESS_PAGE_SIZE", 64))
+# сколько готовых пачек может ждать следующей стадии конвейера
+PROCESS_PREFETCH = int(os.getenv("PROCESS_PREFETCH", 1))
+
+
+def parse_responses(responses: list[str]):
+    """Cleans markdown from model answers and parses them as JSON
+
+    Args:
+        responses (list[str]): raw answers of the model
+
+    Returns:
+        list[dict] | dict: parsed answers or an error with the raw answers
+    """
+    cleaned = [remove_json_markdown(response) for response in responses]
+    if all(is_valid_json(response) for response in cleaned):
+        return [json.loads(response) for response in cleaned]
+    return {"error": "Invalid JSON in model response", "raw": cleaned}
+
+
+async def prefetch(stream: AsyncIterator, size: int = PROCESS_PREFETCH):
+    """Runs the stream ahead of the consumer in a separate task, at most
+    `size` items are buffered. The next page is read from the database and
+    its prompts are built while the model generates the current one"""
+    queue = asyncio.Queue(maxsize=size)
+    done = object()
+
+    async def produce():
+        try:
+            async for item in stream:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
+
+    task = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        task.cancel()
+
+
+async def fetch_articles(
+    feed_id: int, req_id: int, page_size: int = PROCESS_PAGE_SIZE
+) -> AsyncIterator[list]:
+    """Yields pages of unprocessed articles of the feed, every page is read
+    in its own short session by keyset on article_id"""
+    after_id = None
+    while True:
+        page = await ArticlesDAO.find_articles_without_analysis(
+            feed_id, req_id, after_id=after_id, limit=page_size
+        )
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after_id = page[-1].article_id
+
+
+async def build_prompts(
+    pages: AsyncIterator[list], generator: GenerationService, analysis
+) -> AsyncIterator[tuple[list, list]]:
+    """Retrieves context for a page of articles in one batch query
+    and builds their conversations"""
+    async for page in pages:
+        # контекст для всех статей страницы достаётся одним пакетным запросом
+        prompts = await build_feed_prompts(
+            requests=[
+                {"category": analysis.category, "text": article.title}
+                for article in page
+            ],
+            query_embeddings=np.asarray(
+                [article.embeddings for article in page], dtype=np.float32
+            ),
+            builder=generator.prompt_builder,
+        )
+        yield page, [prompt.messages for prompt in prompts]
+
+
+async def generate(
+    batches: AsyncIterator[tuple[list, list]], generator: GenerationService
+) -> AsyncIterator[tuple[list, list]]:
+    """Generates answers for a page, a failed page gets the error as answers"""
+    async for page, conversations in batches:
+        try:
+            # генерация блокирующая, выносим её из event loop
+            responses = await asyncio.to_thread(
+                generator.generate_batch, conversations
+            )
+        except Exception as e:
+            print(e)
+            responses = [{"error": str(e)}] * len(page)
+        yield page, responses
+
+
+async def validate(
+    batches: AsyncIterator[tuple[list, list]], req_id: int
+) -> AsyncIterator[list[dict]]:
+    """Parses answers and turns them into rows of llm_conns"""
+    async for page, responses in batches:
+        yield [
+            {
+                "request_id": req_id,
+                "article_id": article.article_id,
+                "response": (
+                    response
+                    if isinstance(response, dict)
+                    else parse_responses([response])
+                ),
+            }
+            for article, response in zip(page, responses)
+        ]
+
+
+async def persist(batches: AsyncIterator[list[dict]]) -> AsyncIterator[list[int]]:
+    """Stores every page in one transaction, subscribers of the analysis
+    are notified on commit
+
+    Yields:
+        list[int]: conn_id of the stored answers
+    """
+    async for rows in batches:
+        yield await LLMConnectionsDAO.add_results(rows)
+
+
+def process_feed(
+    analysis,
+    feed_id: int,
+    generator: GenerationService,
+    page_size: int = PROCESS_PAGE_SIZE,
+) -> AsyncIterator[list[int]]:
+    """Pipeline of the feed: fetch -> prompts -> generate -> validate ->
+    persist. Only a few pages are in memory at once whatever the backlog
+
+    Returns:
+        AsyncIterator[list[int]]: conn_id of every stored page
+    """
+    pages = fetch_articles(feed_id, analysis.request_id, page_size)
+    prompts = prefetch(build_prompts(pages, generator, analysis))
+    answers = generate(prompts, generator)
+    return persist(prefetch(validate(answers, analysis.request_id)))
+
+
+async def process_document(
+    tokenizer, embedding_model, device, generator, analysis, text
+) -> list[dict]:
+    """Generates answers for all chunks of a document, every answer keeps
+    offsets of its chunk for highlighting in the results
+
+    Returns:
+        list[dict]: start, end and parsed response of every chunk
+    """
+    results = []
+    async for start, end, response in process_document_chunks(
+        tokenizer=tokenizer,
+        embedding_model=embedding_model,
+        device=device,
+        request={"category": analysis.category, "text": text},
+        generator=generator,
+    ):
+        parsed = parse_responses([response])
+        results.append(
+            {
+                "start": start,
+                "end": end,
+                "response": parsed[0] if isinstance(parsed, list) else parsed,
+            }
+        )
+    return results
+
 
 async def process(
     args,
-    tokenizer=tokenizer,
-    model=model,
-    embedding_model=embedding_model,
-    device=device,
-):
+    tokenizer=None,
+    model=None,
+    embedding_model=None,
+    device=None,
+    embedding_tokenizer=None,
+    progress: Callable[[int], Awaitable] = None,
+) -> int:
     """process cycle with a set LLM
 
     Args:
         args (_type_): some args if passed
         model (_type_): LLM for answering the questions
         device (str): CUDA or CPU
-        tokenizer (_type_): some tokenizer for a query
+        tokenizer (_type_): tokenizer of the LLM
+        embedding_tokenizer (_type_): tokenizer of the embedding model
+        progress (Callable, optional): awaited with the number of stored
+            answers after every page
+
+    Models not passed are taken from the lazy registry in `models.models`
+
+    Returns:
+        int: number of stored answers
     """
     print("Processing started.")
-    # тут просто запускаем процесс обработки данных в БД до тех пор пока есть неразмеченные данные
-    async with async_session_maker() as session:
-        analysis = await AnalysesDAO.find_one_or_none_by_id(args.req_id)
-        connections_to_process = []
-        texts_to_process = []
-        embeddings = []
-        if hasattr(args, "feed_id"):
-            src_type = "feed"
-            entries = await ArticlesDAO.find_articles_without_analysis(
-                args.feed_id, args.req_id
-            )
+    tokenizer = tokenizer or registry.get_tokenizer()
+    model = model or registry.get_model()
+    generator = get_generation_service(model, tokenizer)
+    analysis = await AnalysesDAO.find_one_or_none_by_id(args.req_id)
+    processed = 0
 
-            for entry in entries:
-                conn = LLMConnection(
-                    article_id=entry.article_id, requset_id=args.req_id
-                )
-                session.add(conn)
-                connections_to_process.append(conn)
-                texts_to_process.append(entry.title)
-                embeddings.append(entry.embeddings)
-            await session.commit()
-
-        if hasattr(args, "document_id"):
-            src_type = "document"
-            # 1-й способ: для conn делим докумнент на отрывки,каждый отрывок берём и в цикле обрабатываем, а результаты обработки складываем в один response.
-
-            document = DocumentsDAO().find_one_or_none_by_id(
-                document_id=args.document_id
+    if hasattr(args, "feed_id"):
+        async for conn_ids in process_feed(analysis, args.feed_id, generator):
+            processed += len(conn_ids)
+            if progress is not None:
+                await progress(processed)
+
+    if hasattr(args, "document_id"):
+        embedding_model = embedding_model or registry.get_embedder()
+        embedding_tokenizer = embedding_tokenizer or registry.get_embedding_tokenizer()
+        device = device or registry.get_device()
+        document = await DocumentsDAO().find_one_or_none_by_id(args.document_id)
+        try:
+            response = await process_document(
+                embedding_tokenizer,
+                embedding_model,
+                device,
+                generator,
+                analysis,
+                document.content,
             )
-            conn = LLMConnection(document_id=args.document_id, requset_id=args.req_id)
-            session.add(conn)
-            connections_to_process.append(conn)
-            texts_to_process.append(document.content)
-            embeddings.append(document.embeddings)
-            await session.commit()
-
-        for conn, text, embedding in zip(
-            connections_to_process, texts_to_process, embeddings
-        ):
-            # print((await llm_conn.awaitable_attrs.article).title)
-            try:
-                responses = await rag_processing(
-                    tokenizer=tokenizer,
-                    model=model,
-                    embedding_model=embedding_model,
-                    device=device,
-                    request={
-                        "category": analysis.category,
-                        "text": text,
-                    },
-                    query_embedding=embedding,
-                    src_type=src_type,
-                )
-                # print(response)
-
-                responses = map(remove_json_markdown, responses)
-                if map(is_valid_json, responses):
-                    conn.response = responses
-            except Exception as e:
-                print(e)
-                conn.response = {"error": str(e)}
-            finally:
-                await session.commit()
-                await session.refresh(conn)  # Получить актуальное `updated_at`
-
-    # await session.execute(text("DELETE FROM llm_conn;"))
-    # await session.commit()
-    print("Processing complete!")
+        except Exception as e:
+            print(e)
+            response = {"error": str(e)}
+        await LLMConnectionsDAO.add_results(
+            [
+                {
+                    "request_id": args.req_id,
+                    "document_id": args.document_id,
+                    "response": response,
+                }
+            ]
+        )
+        processed += 1
+
+    print(f"Processing complete! {processed} answers stored.")
+    return processed
@@ -0,0 +1,113 @@
+import os
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+from rag.templates import context, template
+
+load_dotenv()
+
+
+@dataclass(frozen=True)
+class Prompt:
+    messages: list[dict[str, str]]
+    prompt_tokens: int
+    context_truncated: bool
+
+
+class PromptBuilder:
+    def __init__(
+        self,
+        tokenizer: any,
+        token_budget: int = int(os.getenv("PROMPT_TOKEN_BUDGET", 1536)),
+    ):
+        """Builds a fresh message list for every request from the immutable
+        templates and keeps the prompt within the token budget
+
+        Args:
+            tokenizer (any): tokenizer of the LM, used to count tokens
+            token_budget (int, optional): max number of prompt tokens
+        """
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.truncated = 0
+
+    def messages(self, category: str, text: str, rag_query: str):
+        return [
+            *(dict(message) for message in context),
+            {
+                "role": "user",
+                "content": template.format(
+                    context=rag_query, category=category, text=text
+                ),
+            },
+        ]
+
+    def count_tokens(self, messages: list[dict[str, str]]) -> int:
+        return len(
+            self.tokenizer.apply_chat_template(
+                messages, tokenize=True, add_generation_prompt=True
+            )
+        )
+
+    def build(
+        self,
+        category: str,
+        text: str,
+        context_items: list[str],
+        separator: str = " ",
+    ) -> Prompt:
+        """Builds messages for a single request. Retrieved context is cut
+        so that the whole prompt fits into the token budget, the text being
+        analysed is never cut
+
+        Args:
+            category (str): classification category
+            text (str): text to analyse
+            context_items (list[str]): retrieved context, most relevant first
+            separator (str, optional): separator of context items
+
+        Returns:
+            Prompt: messages and the number of prompt tokens
+        """
+        # сколько токенов остаётся на контекст после шаблона и самого текста
+        available = self.token_budget - self.count_tokens(
+            self.messages(category, text, "")
+        )
+        separator_tokens = len(
+            self.tokenizer(separator, add_special_tokens=False)["input_ids"]
+        )
+
+        kept = []
+        truncated = False
+        for item in context_items:
+            ids = self.tokenizer(item, add_special_tokens=False)["input_ids"]
+            cost = len(ids) + (separator_tokens if kept else 0)
+            if cost <= available:
+                kept.append(item)
+                available -= cost
+                continue
+            # последний элемент обрезаем до оставшегося бюджета
+            room = available - (separator_tokens if kept else 0)
+            if room > 0:
+                kept.append(self.tokenizer.decode(ids[:room]))
+            truncated = True
+            break
+
+        messages = self.messages(category, text, separator.join(kept))
+        prompt_tokens = self.count_tokens(messages)
+        self.prompts += 1
+        self.prompt_tokens += prompt_tokens
+        self.truncated += truncated
+        return Prompt(messages, prompt_tokens, truncated)
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "prompts": self.prompts,
+            "avg_prompt_tokens": self.prompt_tokens / self.prompts
+            if self.prompts
+            else 0.0,
+            "truncated": self.truncated,
+        }
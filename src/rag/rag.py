@@ -1,21 +1,94 @@
+import asyncio
 import json
+import os
+from collections.abc import AsyncIterator
+from itertools import batched
 
+import numpy as np
 import pandas as pd
-import torch
-from templates import context, template
-from transformers import pipeline
+from dotenv import load_dotenv
 
-from backend.dao.article_dao import ArticlesDAO
 from crawler.processor import get_embeddings
-from utils import find_top_similar_texts, split_text_into_paragraphs
+from rag.generation import GenerationService, get_generation_service
+from rag.prompt import Prompt, PromptBuilder
+from rag.vector_index import get_retriever
+from utils import iter_text_chunks, top_k_similar
 
-torch.random.manual_seed(42)
+load_dotenv()
+
+# размер отрывка документа в токенах и сколько отрывков обрабатывается за раз
+DOCUMENT_CHUNK_TOKENS = int(os.getenv("DOCUMENT_CHUNK_TOKENS", 128))
+DOCUMENT_WINDOW = int(os.getenv("DOCUMENT_WINDOW", 32))
 
 # Ошибки в обработке: одни и те же слова в нескольких классах, иногда путает class с level (при установке predicted_level в примере), появление больших повторений в в одном классе
 # из-за чего не хватает токенов для полного ответа, неточность в классификации, пытается отнести к классу даже то что не имеет значения, иногда отсутствуют вероятности,
 # классифицирует как low хотя вероятность не наибольшая среди классов, иногда интерпретирует русские слова на английском и выдаёт мусор
 
 
+def format_context(result) -> list[str]:
+    """turns retrieved rows into context items for the prompt
+
+    Args:
+        result (list[Row]): title, description, category and response
+
+    Returns:
+        list[str]: context items, most relevant first
+    """
+    # <text>:{title}. {description};
+    return [
+        f"<category>:{category};<result>:{json.dumps(response, ensure_ascii=False)}"
+        if response
+        else f"{title}.{description}"
+        for title, description, category, response in result
+    ]
+
+
+async def build_feed_prompt(
+    request: dict[str, str], query_embedding: list[float], builder: PromptBuilder
+) -> Prompt:
+    """retrieve relevant articles from database and build the prompt
+    for a single article
+
+    Args:
+        request (dict[str, str]): category and text of the article
+        query_embedding (list[float]): embedding of the article
+        builder (PromptBuilder): prompt builder of the generation service
+
+    Returns:
+        Prompt: new list of messages within the token budget
+    """
+    result = await get_retriever().get_relevant_data_from_articles(
+        query_embedding=query_embedding
+    )
+    prompt = builder.build(request["category"], request["text"], format_context(result))
+    print(f"Prompt tokens: {prompt.prompt_tokens}")
+    return prompt
+
+
+async def build_feed_prompts(
+    requests: list[dict[str, str]], query_embeddings: any, builder: PromptBuilder
+) -> list[Prompt]:
+    """retrieve context for many articles in one batch query and build their prompts
+
+    Args:
+        requests (list[dict[str, str]]): category and text of every article
+        query_embeddings (any): matrix of article embeddings
+        builder (PromptBuilder): prompt builder of the generation service
+
+    Returns:
+        list[Prompt]: prompts in the same order as requests
+    """
+    results = await get_retriever().get_relevant_data_for_many(query_embeddings)
+    prompts = []
+    for request, result in zip(requests, results):
+        prompt = builder.build(
+            request["category"], request["text"], format_context(result)
+        )
+        print(f"Prompt tokens: {prompt.prompt_tokens}")
+        prompts.append(prompt)
+    return prompts
+
+
 async def rag_processing(
     tokenizer: any,
     model: any,
@@ -24,93 +97,112 @@ async def rag_processing(
     request: dict[str, str],
     query_embedding: any,
     src_type: str,
+    generator: GenerationService = None,
+    embedding_tokenizer: any = None,
 ) -> list[str]:
     """get embedding of a query, retrieve relevant context from database
     and generate the response
 
     Args:
-        tokenizer (_type_): some tokenizer
+        tokenizer (_type_): tokenizer of the LLM
         model (_type_): model to generate response
         device (_type_): cpu or cuda
         request (_type_): list containig category and text from the source
+        generator (GenerationService, optional): shared generation service
+        embedding_tokenizer (any, optional): tokenizer of the embedding model.
+            Defaults to the one from `models.models`.
     """
 
-    if not query_embedding:
-        query_embedding, _ = get_embeddings(
-            tokenizer=tokenizer,
-            model=embedding_model,
-            device=device,
-            df=pd.DataFrame(request["text"]),
-        )
-
-    query_embedding = query_embedding.tolist()[0]
-    # print(shape)
-    # if shape != 768:
-    #     projection = nn.Linear(shape, 768).half().eval().to(device)
-    #     query_embedding = projection(query_embedding)
-
-    # making async request to database with set condition to get 5 max relevant examples
-    pipe = pipeline(
-        "text-generation",
-        model=model,
-        tokenizer=tokenizer,
-    )
+    # пайплайн создаётся один раз на процесс, а не на каждый запрос
+    if generator is None:
+        generator = get_generation_service(model, tokenizer)
+    if embedding_tokenizer is None:
+        from models.models import get_embedding_tokenizer
 
-    generation_args = {
-        "max_new_tokens": 200,
-        "return_full_text": False,
-        "do_sample": False,
-    }
+        embedding_tokenizer = get_embedding_tokenizer()
 
     if src_type == "feed":
-        result = await ArticlesDAO.get_relevant_data_from_articles(
-            query_embedding=query_embedding
+        if query_embedding is None:
+            query_embedding, _ = get_embeddings(
+                tokenizer=embedding_tokenizer,
+                model=embedding_model,
+                device=device,
+                df=pd.DataFrame([request["text"]]),
+            )
+
+        # из БД приходит вектор, из get_embeddings -- матрица из одной строки
+        query_embedding = (
+            np.asarray(query_embedding, dtype=np.float32).reshape(-1).tolist()
         )
-        # <text>:{title}. {description};
-        combined_results = [
-            f"<category>:{category};<result>:{json.dumps(response, ensure_ascii=False)}"
-            if response
-            else f"{title}.{description}"
-            for title, description, category, response in result
-        ]
-        rag_query = " ".join(combined_results)
-        query_template = template.format(
-            context=rag_query, category=request["category"], text=request["text"]
+        prompt = await build_feed_prompt(
+            request, query_embedding, generator.prompt_builder
         )
-
-        # добавляем запрос к контексту
-        context.append({"role": "user", "content": query_template})
-
-        output = pipe(context, **generation_args)
-        return [output[0]["generated_text"]]
+        return [generator.generate(prompt.messages)]
 
     # если обрабоатвается документ контектс должен состоять из фрагментов текста того же источника
     # сами ответы модели можно не брать, чтобы не перегружать
     if src_type == "document":
-        # делим документ на части до 500 символов
-        texts = split_text_into_paragraphs(request["text"], 500)
-        # для каждого абзаца вычисляем эмбеддинг и косинусное расстояние
+        return [
+            response
+            async for _, _, response in process_document_chunks(
+                tokenizer=embedding_tokenizer,
+                embedding_model=embedding_model,
+                device=device,
+                request=request,
+                generator=generator,
+            )
+        ]
+
+
+async def process_document_chunks(
+    tokenizer: any,
+    embedding_model: any,
+    device: str,
+    request: dict[str, str],
+    generator: GenerationService,
+    chunk_tokens: int = DOCUMENT_CHUNK_TOKENS,
+    window: int = DOCUMENT_WINDOW,
+) -> AsyncIterator[tuple[int, int, str]]:
+    """split the document into chunks and generate a response for every chunk,
+    context of a chunk is made of similar chunks of the same window.
+    Chunks are processed window by window, so generation starts before
+    the whole document is split
+
+    Args:
+        tokenizer (any): tokenizer of the embedding model, also measures chunks
+        embedding_model (any): embedding model
+        device (str): cpu or cuda
+        request (dict[str, str]): category and text of the document
+        generator (GenerationService): shared generation service
+        chunk_tokens (int, optional): max chunk size in tokens
+        window (int, optional): number of chunks processed together
+
+    Yields:
+        tuple[int, int, str]: offsets of the chunk in the text and the response
+    """
+    text = request["text"]
+    chunks = iter_text_chunks(text, target_length=chunk_tokens, tokenizer=tokenizer)
+    for spans in batched(chunks, window):
+        texts = [text[start:end] for start, end in spans]
+        # для каждого отрывка вычисляем эмбеддинг и косинусное расстояние
         embeddings, _ = get_embeddings(
             tokenizer=tokenizer,
             model=embedding_model,
             device=device,
             df=pd.DataFrame(texts),
-        )[0].values.tolist()
-
-        responses = []
+        )
         # Получаем топ-3 похожих текста для каждого
-        result = find_top_similar_texts(texts, embeddings, top_k=3)
-
-        # Выводим результаты
-        for text, similar_texts in result.items():
-            rag_query = "//".join(similar_texts)
-            query_template = template.format(
-                context=rag_query, category=request["category"], text=text
+        indices, _ = top_k_similar(embeddings, top_k=3)
+        prompts = []
+        for chunk, neighbours in zip(texts, indices):
+            prompt = generator.prompt_builder.build(
+                request["category"],
+                chunk,
+                [texts[j] for j in neighbours],
+                separator="//",
             )
-
-            # добавляем запрос к контексту
-            context.append({"role": "user", "content": query_template})
-
-            output = pipe(context, **generation_args)
-            responses.append(output[0]["generated_text"])
-        return responses
+            print(f"Prompt tokens: {prompt.prompt_tokens}")
+            prompts.append(prompt.messages)
+        responses = await asyncio.to_thread(generator.generate_batch, prompts)
+        for (start, end), response in zip(spans, responses):
+            yield start, end, response
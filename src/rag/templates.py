@@ -1,4 +1,6 @@
-context = [
+from types import MappingProxyType
+
+_messages = [
     {
         "role": "system",
         "content": """You are an AI assistant that returns ONLY JSON answers. If you output anything but JSON you will have FAILED. Follow these rules:
@@ -41,6 +43,8 @@ context = [
     """,
     },
 ]
+# шаблоны неизменяемы: сообщения для каждого запроса собирает rag.prompt.PromptBuilder
+context = tuple(MappingProxyType(message) for message in _messages)
 
 template = """
     Context: {context}
@@ -0,0 +1,236 @@
+import asyncio
+import atexit
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+from backend.dao.article_dao import ArticlesDAO
+from utils import top_k_dot
+
+load_dotenv()
+
+
+class ArticleVectorIndex:
+    def __init__(
+        self,
+        path: str = os.getenv("VECTOR_INDEX_DIR", "~/data/vector_index"),
+        refresh_seconds: float = float(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", 60)),
+        save_seconds: float = float(os.getenv("VECTOR_INDEX_SAVE_SECONDS", 600)),
+        memory_budget_mb: int = int(os.getenv("VECTOR_INDEX_SEARCH_MB", 64)),
+        overlap_seconds: float = float(
+            os.getenv("VECTOR_INDEX_OVERLAP_SECONDS", 900)
+        ),
+    ):
+        """In-process index of article embeddings with model answers.
+        Rows are normalized, so cosine similarity is a single matrix product.
+        Has the same retrieval interface as ArticlesDAO
+
+        The index is loaded lazily: from memory-mapped files if they exist,
+        then from `articles` and `llm_conns`. Later refreshes load only rows
+        changed since the previous one (by `updated_at`); deleted rows stay
+        until `rebuild()`. `updated_at` is the start of the writing
+        transaction, so a row can commit after a refresh with a time below
+        the watermark: every refresh re-reads overlap_seconds before it, rows
+        already in the index are overwritten by conn_id. Files are rewritten
+        at most every save_seconds and at process exit: a stale copy is safe,
+        its watermark makes the next start load the missing rows from the DB
+
+        Args:
+            path (str): directory for persistence, persistence is off if empty
+            refresh_seconds (float): min interval between refreshes from the DB
+            save_seconds (float): min interval between saves to disk
+            memory_budget_mb (int): memory for one block of search scores
+            overlap_seconds (float): re-read window before the watermark,
+                must be longer than the longest writing transaction
+        """
+        self.path = Path(path).expanduser() if path else None
+        self.refresh_seconds = refresh_seconds
+        self.save_seconds = save_seconds
+        self.memory_budget_mb = memory_budget_mb
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.saved_at = time.monotonic()
+        self.unsaved = False
+        self.matrix: np.ndarray | None = None
+        self.conn_ids = np.empty(0, dtype=np.int64)
+        self.labeled = np.empty(0, dtype=bool)
+        self.payload: list[tuple] = []
+        self.positions: dict[int, int] = {}
+        self.watermark: datetime | None = None
+        self.refreshed_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.payload)
+
+    async def ensure_fresh(self):
+        async with self.lock:
+            if self.matrix is None:
+                self.load()
+            if time.monotonic() - self.refreshed_at >= self.refresh_seconds:
+                await self.refresh()
+
+    async def refresh(self):
+        """Loads rows changed since the watermark minus the overlap window
+        and merges them into the index"""
+        rows = await ArticlesDAO.find_retrieval_rows(
+            updated_since=self.watermark - self.overlap if self.watermark else None
+        )
+        self.refreshed_at = time.monotonic()
+        if not rows:
+            return
+
+        vectors = np.asarray([row.embeddings for row in rows], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if self.matrix is None or not len(self.matrix):
+            self.matrix = np.empty((0, vectors.shape[1]), dtype=np.float32)
+        elif not self.matrix.flags.writeable:
+            # матрица из файла открыта только на чтение
+            self.matrix = np.array(self.matrix)
+
+        new_rows = []
+        for vector, row in zip(vectors, rows):
+            payload = (row.title, row.description, row.category, row.response)
+            position = self.positions.get(row.conn_id)
+            if position is None:
+                new_rows.append((vector, row, payload))
+                continue
+            self.matrix[position] = vector
+            self.labeled[position] = row.is_labeled
+            self.payload[position] = payload
+
+        if new_rows:
+            start = len(self.payload)
+            self.matrix = np.vstack(
+                [self.matrix, [vector for vector, _, _ in new_rows]]
+            )
+            self.conn_ids = np.concatenate(
+                [self.conn_ids, [row.conn_id for _, row, _ in new_rows]]
+            )
+            self.labeled = np.concatenate(
+                [self.labeled, [row.is_labeled for _, row, _ in new_rows]]
+            )
+            for offset, (_, row, payload) in enumerate(new_rows):
+                self.positions[row.conn_id] = start + offset
+                self.payload.append(payload)
+
+        # окно перечитывания может не дать строк новее водяного знака
+        self.watermark = max(
+            self.watermark or datetime.min, *(row.updated_at for row in rows)
+        )
+        self.unsaved = True
+        if time.monotonic() - self.saved_at >= self.save_seconds:
+            self.save()
+
+    async def rebuild(self):
+        """Drops the index and loads it from the DB from scratch"""
+        async with self.lock:
+            self.matrix = None
+            self.conn_ids = np.empty(0, dtype=np.int64)
+            self.labeled = np.empty(0, dtype=bool)
+            self.payload = []
+            self.positions = {}
+            self.watermark = None
+            await self.refresh()
+
+    def load(self):
+        """Opens the persisted index, the matrix is memory-mapped"""
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        if self.path is None or not (self.path / "meta.json").exists():
+            return
+        meta = json.loads((self.path / "meta.json").read_text())
+        self.matrix = np.load(self.path / "matrix.npy", mmap_mode="r")
+        self.conn_ids = np.load(self.path / "conn_ids.npy")
+        self.labeled = np.load(self.path / "labeled.npy")
+        self.payload = [tuple(item) for item in meta["payload"]]
+        self.positions = {int(conn_id): i for i, conn_id in enumerate(self.conn_ids)}
+        self.watermark = (
+            datetime.fromisoformat(meta["watermark"]) if meta["watermark"] else None
+        )
+
+    def flush(self):
+        """Saves the index if it changed since the last save"""
+        if self.unsaved:
+            self.save()
+
+    def save(self):
+        self.saved_at = time.monotonic()
+        self.unsaved = False
+        if self.path is None or self.matrix is None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        for name, array in (
+            ("matrix", self.matrix),
+            ("conn_ids", self.conn_ids),
+            ("labeled", self.labeled),
+        ):
+            np.save(self.path / f"{name}.tmp.npy", array)
+            os.replace(self.path / f"{name}.tmp.npy", self.path / f"{name}.npy")
+        meta = {
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "payload": self.payload,
+        }
+        (self.path / "meta.tmp.json").write_text(json.dumps(meta, ensure_ascii=False))
+        os.replace(self.path / "meta.tmp.json", self.path / "meta.json")
+
+    def search(
+        self, queries: np.ndarray, max_entries: int, choose_labeled: bool
+    ) -> list[list[tuple]]:
+        """Top-k rows by cosine similarity for every query"""
+        if not len(self.payload):
+            return [[] for _ in queries]
+        dim = self.matrix.shape[1]
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, dim)
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+        )
+
+        def exclude_unlabeled(scores: np.ndarray, start: int):
+            scores[:, ~self.labeled] = -np.inf
+
+        # оценки считаются блоками запросов, вся матрица запросы x строки не нужна
+        top, top_scores = top_k_dot(
+            queries,
+            self.matrix,
+            max_entries,
+            self.memory_budget_mb,
+            adjust=exclude_unlabeled if choose_labeled else None,
+        )
+        return [
+            [self.payload[i] for i, score in zip(rows, scores) if np.isfinite(score)]
+            for rows, scores in zip(top, top_scores)
+        ]
+
+    async def get_relevant_data_from_articles(
+        self, query_embedding, max_entries=5, choose_labeled=False, **kwargs
+    ):
+        """Same as ArticlesDAO.get_relevant_data_from_articles, ANN parameters
+        are accepted for compatibility and ignored"""
+        await self.ensure_fresh()
+        return self.search([query_embedding], max_entries, choose_labeled)[0]
+
+    async def get_relevant_data_for_many(
+        self, query_embeddings, max_entries=5, choose_labeled=False, **kwargs
+    ):
+        """Same as ArticlesDAO.get_relevant_data_for_many"""
+        await self.ensure_fresh()
+        return self.search(query_embeddings, max_entries, choose_labeled)
+
+
+_index: ArticleVectorIndex | None = None
+
+
+def get_retriever():
+    """Returns retrieval backend set by RAG_RETRIEVAL_BACKEND: `db` (default)
+    searches with pgvector, `memory` uses the in-process index"""
+    global _index
+    if os.getenv("RAG_RETRIEVAL_BACKEND", "db").lower() != "memory":
+        return ArticlesDAO
+    if _index is None:
+        _index = ArticleVectorIndex()
+        atexit.register(_index.flush)
+    return _index
@@ -0,0 +1,78 @@
+"""Parity of ONNX Runtime and PyTorch embedding backends.
+
+A small randomly initialised BERT is exported, so the test needs no
+downloads, only the `mlstuff` and `onnx` extras. Run from the repo root:
+
+    python -m pytest src/tests
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("onnxruntime")
+
+from crawler import onnx_engine  # noqa: E402
+from crawler.onnx_engine import OnnxEmbeddingEngine, parity  # noqa: E402
+from crawler.processor import EmbeddingEngine  # noqa: E402
+
+SENTENCES = [
+    "Центральный банк сохранил ключевую ставку на прежнем уровне.",
+    "The company reported record quarterly revenue and raised its forecast.",
+    "В регионе ожидаются сильные дожди и порывистый ветер.",
+    "Researchers published a new method for protein structure prediction.",
+    "A short one.",
+]
+TOLERANCE = 0.99
+INT8_TOLERANCE = 0.95
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tmp_path_factory):
+    # словарь из символов предложений, чтобы токенизатор не качать
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    vocab += sorted({char for sentence in SENTENCES for char in sentence.lower()})
+    path = tmp_path_factory.mktemp("tokenizer") / "vocab.txt"
+    path.write_text("\n".join(vocab), encoding="utf-8")
+    return transformers.BertTokenizerFast(vocab_file=str(path))
+
+
+@pytest.fixture(scope="module")
+def model(tokenizer):
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=128,
+    )
+    return transformers.BertModel(config).eval()
+
+
+@pytest.mark.parametrize("pooling", ["mean", "cls", "last"])
+def test_onnx_matches_torch(tokenizer, model, tmp_path, pooling):
+    reference = EmbeddingEngine(
+        tokenizer=tokenizer, model=model, device="cpu", pooling=pooling
+    )
+    candidate = OnnxEmbeddingEngine(
+        tokenizer, model, path=str(tmp_path), quantize=False, pooling=pooling
+    )
+    assert parity(reference, candidate, SENTENCES) >= TOLERANCE
+
+
+def test_int8_onnx_close_to_torch(tokenizer, model, tmp_path):
+    reference = EmbeddingEngine(tokenizer=tokenizer, model=model, device="cpu")
+    candidate = OnnxEmbeddingEngine(
+        tokenizer, model, path=str(tmp_path), quantize=True
+    )
+    assert parity(reference, candidate, SENTENCES) >= INT8_TOLERANCE
+
+
+def test_export_failure_falls_back_to_torch(tokenizer, model, monkeypatch):
+    def broken_export(self):
+        raise RuntimeError("export failed")
+
+    monkeypatch.setattr(OnnxEmbeddingEngine, "export", broken_export)
+    monkeypatch.setattr(onnx_engine, "_engines", {})
+    assert onnx_engine.get_onnx_engine(tokenizer, model) is None
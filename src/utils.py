@@ -1,11 +1,15 @@
-import csv
 import datetime
 import json
 import os
 import re
-from pathlib import Path
-
-import nltk
+import threading
+from collections import Counter, deque
+from collections.abc import Iterator
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+import lxml.etree
+import lxml.html
 import numpy as np
 import pandas as pd
 import pytz
@@ -13,13 +17,9 @@ from bs4 import BeautifulSoup
 from dateutil import parser as dateutil_parser
 from delorean import parse as delorean_date_parse
 from dotenv import load_dotenv
-from sklearn.metrics.pairwise import cosine_similarity
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.ext.asyncio import create_async_engine
 
-nltk.download("punkt")
-nltk.download("punkt_tab")
-
 load_dotenv()
 
 
@@ -40,17 +40,29 @@ def get_async_db_connection_engine() -> Engine:
     return engine
 
 
-def parse_time(ts: str, named_timezones=("EST", "GMT", "UTC")) -> datetime.datetime:
-    """
-    Parses a time string with either offsets like +0000 of timezones like EST, GMT, UTC.
-    :param ts: a string formatted like 'Mon, 25 Apr 2022 13:47:46 +0000' or with time zone in the end
-    :param named_timezones: a fixed tuple of timezones to map to those known to PyTZ
-    :return: a timezone-aware datetime.datetime object
-    """
+# сколько дат разобрано быстрым путём и сколько ушло в медленные парсеры
+parse_time_counters = Counter()
+# нормализация фидов может идти в нескольких потоках, а `Counter +=` не атомарен
+_parse_time_counters_lock = threading.Lock()
+
+
+def _count_parse_times(fast: int, fallback: int):
+    with _parse_time_counters_lock:
+        parse_time_counters["fast"] += fast
+        parse_time_counters["fallback"] += fallback
+
+
+@lru_cache(maxsize=8)
+def _tzinfos(named_timezones: tuple[str, ...]) -> dict:
+    return {tz: pytz.timezone(tz) for tz in named_timezones}
+
+
+def _parse_time_slow(
+    ts: str, named_timezones=("EST", "GMT", "UTC")
+) -> datetime.datetime:
     # if one of EST, GMT, UTC is specified as a timezone, parse it with dateutils
-    tzinfos = {tz: pytz.timezone(tz) for tz in named_timezones}
     if ts[-3:] in named_timezones:
-        dt = dateutil_parser.parse(ts, tzinfos=tzinfos)
+        dt = dateutil_parser.parse(ts, tzinfos=_tzinfos(tuple(named_timezones)))
 
     # if instead an offset is specified like +0100, we use the delorean parser
     elif re.match(pattern=r"[\+\-]\d{4}", string=ts[-5:]):
@@ -63,6 +75,72 @@ def parse_time(ts: str, named_timezones=("EST", "GMT", "UTC")) -> datetime.datet
     return dt.replace(tzinfo=None)
 
 
+def _parse_time_fast(ts: str) -> datetime.datetime | None:
+    """RFC 822 (RSS) and ISO 8601 (Atom) dates, None for anything else"""
+    ts = ts.strip()
+    # у RFC 822 день недели или число в начале, у ISO 8601 -- год
+    if ts[:4].isdigit():
+        try:
+            return datetime.datetime.fromisoformat(ts).replace(tzinfo=None)
+        except ValueError:
+            return None
+    try:
+        return parsedate_to_datetime(ts).replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+@lru_cache(maxsize=16384)
+def _parse_time_cached(ts: str, named_timezones) -> tuple[datetime.datetime, bool]:
+    # одни и те же статьи приходят при каждом опросе фида, их даты берём из кэша
+    dt = _parse_time_fast(ts)
+    if dt is not None:
+        return dt, True
+    return _parse_time_slow(ts, named_timezones), False
+
+
+def parse_time(ts: str, named_timezones=("EST", "GMT", "UTC")) -> datetime.datetime:
+    """
+    Parses a time string with either offsets like +0000 of timezones like EST, GMT, UTC.
+    RFC 822 and ISO 8601 strings are parsed by the standard library,
+    only unusual strings go through dateutil/delorean.
+    :param ts: a string formatted like 'Mon, 25 Apr 2022 13:47:46 +0000' or with time zone in the end
+    :param named_timezones: a fixed tuple of timezones to map to those known to PyTZ
+    :return: a datetime.datetime object with the local time of the string, without tzinfo
+    """
+    dt, fast = _parse_time_cached(ts, tuple(named_timezones))
+    _count_parse_times(int(fast), int(not fast))
+    return dt
+
+
+def parse_times(values: list[str]) -> tuple[list[datetime.datetime], int]:
+    """
+    Parses a column of time strings.
+    :param values: time strings
+    :return: parsed datetimes and the number of strings parsed by the slow path
+    """
+    named_timezones = ("EST", "GMT", "UTC")
+    parsed, fallbacks = [], 0
+    # считаем медленные разборы этого вызова, а не разницу общего счётчика:
+    # соседние потоки в это время разбирают свои фиды
+    for ts in values:
+        dt, fast = _parse_time_cached(ts, named_timezones)
+        parsed.append(dt)
+        fallbacks += not fast
+    _count_parse_times(len(parsed) - fallbacks, fallbacks)
+    return parsed, fallbacks
+
+
+def parse_time_stats() -> dict[str, int | float]:
+    """Fast path and fallback counters of parse_time since the process start"""
+    total = parse_time_counters["fast"] + parse_time_counters["fallback"]
+    return {
+        "fast": parse_time_counters["fast"],
+        "fallback": parse_time_counters["fallback"],
+        "fallback_rate": parse_time_counters["fallback"] / total if total else 0.0,
+    }
+
+
 def parse_html(feed_data) -> str:
     """cleans text from html tags and uses lxml for faster processing
 
@@ -93,6 +171,40 @@ def parse_html(feed_data) -> str:
     return clean_text
 
 
+# без тегов и сущностей фрагмент не нужно разбирать как HTML
+_MARKUP = re.compile(r"[<&]")
+
+
+@lru_cache(maxsize=16384)
+def _clean_html_fragment(fragment: str) -> str:
+    if not _MARKUP.search(fragment):
+        return " ".join(fragment.split())
+    try:
+        root = lxml.html.fromstring(fragment)
+        # как и BeautifulSoup.get_text, не берём скрипты, стили и комментарии
+        for element in list(root.iter("script", "style", lxml.etree.Comment)):
+            if element is not root:
+                element.drop_tree()
+        return " ".join(" ".join(root.itertext()).split())
+    except (lxml.etree.LxmlError, ValueError):
+        return parse_html(fragment)
+
+
+def clean_html_batch(fragments: list[str]) -> list[str]:
+    """cleans a batch of html fragments, e.g. all descriptions of a feed.
+    Fragments without markup only get whitespace normalized, the rest are
+    parsed by lxml directly; results are cached by fragment, malformed
+    fragments fall back to parse_html
+
+    Args:
+        fragments (list[str]): html fragments, None is treated as empty
+
+    Returns:
+        list[str]: cleaned texts in the same order
+    """
+    return [_clean_html_fragment(fragment or "") for fragment in fragments]
+
+
 def filter_on_publication_date(
     df: pd.DataFrame, min_date: str, pub_timestamp_col_name: str = "pub_date"
 ) -> pd.DataFrame:
@@ -125,55 +237,142 @@ def is_valid_json(json_string):
     return True
 
 
-def split_text_into_paragraphs(text, target_length=500):
-    sentences = nltk.sent_tokenize(text)  # разбиваем текст на предложения
-    paragraphs = []
-    current_paragraph = ""
+@lru_cache(maxsize=4)
+def _sentence_tokenizer(language: str):
+    """Punkt sentence tokenizer, the model is downloaded on first use only"""
+    import nltk
+    from nltk.tokenize import PunktTokenizer
 
-    for sentence in sentences:
-        # Если добавление нового предложения не превысит целевой размер
-        if len(current_paragraph + sentence) <= target_length:
-            current_paragraph += sentence + " "
-        else:
-            # Если абзац уже достаточно большой, сохраняем его
-            if current_paragraph:
-                paragraphs.append(current_paragraph.strip())
-            current_paragraph = sentence + " "
-
-    # Добавляем последний абзац
-    if current_paragraph:
-        paragraphs.append(current_paragraph.strip())
+    try:
+        return PunktTokenizer(language)
+    except LookupError:
+        nltk.download("punkt_tab", quiet=True)
+        return PunktTokenizer(language)
+
+
+def iter_text_chunks(
+    text: str,
+    target_length: int = 500,
+    tokenizer: any = None,
+    overlap: int = 0,
+    language: str = "english",
+) -> Iterator[tuple[int, int]]:
+    """
+    Lazily splits text into chunks of whole sentences and yields their offsets,
+    so the text itself is never copied and the first chunk is available before
+    the whole text is tokenized into sentences.
+
+    :param text: text to split
+    :param target_length: max chunk size in characters, or in tokens if tokenizer is set
+    :param tokenizer: tokenizer used to measure chunk size in tokens
+    :param overlap: number of last sentences of a chunk repeated in the next one
+    :param language: language of the punkt sentence tokenizer
+    :return: (start, end) offsets of chunks, `text[start:end]` is the chunk
+    """
 
-    return paragraphs
+    def measure(start: int, end: int) -> int:
+        if tokenizer is None:
+            return end - start
+        return len(tokenizer(text[start:end], add_special_tokens=False)["input_ids"])
+
+    # (start, end, size) предложений текущего отрывка
+    window: deque[tuple[int, int, int]] = deque()
+    size = 0
+    for start, end in _sentence_tokenizer(language).span_tokenize(text):
+        sentence_size = measure(start, end)
+        if window and size + sentence_size > target_length:
+            yield window[0][0], window[-1][1]
+            # оставляем последние предложения для перекрытия, если они помещаются
+            while len(window) > overlap or (
+                window and size + sentence_size > target_length
+            ):
+                size -= window.popleft()[2]
+        window.append((start, end, sentence_size))
+        size += sentence_size
+
+    if window:
+        yield window[0][0], window[-1][1]
 
 
-def find_top_similar_texts(
-    texts: list[str],
+def split_text_into_paragraphs(text, target_length=500):
+    return [text[start:end] for start, end in iter_text_chunks(text, target_length)]
+
+
+def top_k_dot(
+    queries: np.ndarray,
+    vectors: np.ndarray,
+    top_k: int,
+    memory_budget_mb: int = 64,
+    adjust=None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Finds top_k rows of `vectors` with the largest dot product for every
+    query. Scores are computed for blocks of queries, so the full
+    queries x vectors matrix never exists and memory is bounded by
+    `memory_budget_mb`
+
+    :param queries: matrix (m, dim) of queries
+    :param vectors: matrix (n, dim) to search in
+    :param top_k: number of rows for every query, at most n
+    :param memory_budget_mb: memory for one block of scores
+    :param adjust: called with a block of scores and its first query index,
+        changes scores in place, e.g. sets excluded rows to -inf
+    :return: indices and scores of rows (m, k), largest first
+    """
+    m, n = len(queries), len(vectors)
+    k = max(0, min(top_k, n))
+    indices = np.empty((m, k), dtype=np.int64)
+    scores = np.empty((m, k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+
+    block_size = max(1, memory_budget_mb * 1024 * 1024 // (n * 4))
+    for start in range(0, m, block_size):
+        stop = min(start + block_size, m)
+        sims = queries[start:stop] @ vectors.T
+        if adjust is not None:
+            adjust(sims, start)
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        indices[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    return indices, scores
+
+
+def top_k_similar(
     embeddings: np.ndarray,
     top_k: int = 5,
     exclude_self: bool = True,
-) -> dict[str, list[str]]:  # Теперь возвращает список строк, а не кортежей
-    sim_matrix = cosine_similarity(embeddings)
-    top_matches = {}
-
-    for i, text in enumerate(texts):
-        sim_scores = sim_matrix[i]
-
-        if exclude_self:
-            sim_scores[i] = -np.inf
-
-        top_indices = np.argsort(sim_scores)[-top_k:][::-1]
-        matches = [texts[j] for j in top_indices]  # Берём только текст, без сходства
-        top_matches[text] = matches
-
-    return top_matches
-
-
-def write_request(req: list):
-    data_path = Path("~/data").expanduser()
-    with open(f"{data_path}/requests.csv", "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(req)
+    memory_budget_mb: int = 64,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Finds top_k most similar rows for every row by cosine similarity.
+    Similarities are computed block by block, so the full n x n matrix
+    never exists and memory is bounded by `memory_budget_mb`
+
+    :param embeddings: matrix (n, dim) of text embeddings
+    :param top_k: number of neighbours for every row
+    :param exclude_self: do not return a row as its own neighbour
+    :param memory_budget_mb: memory for one block of similarities
+    :return: indices and scores of neighbours (n, k), most similar first
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    n = len(vectors)
+    # нормируем один раз, дальше косинус -- это скалярное произведение
+    vectors = vectors / np.maximum(
+        np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+    )
+
+    def exclude_diagonal(sims: np.ndarray, start: int):
+        rows = np.arange(len(sims))
+        sims[rows, rows + start] = -np.inf
+
+    return top_k_dot(
+        vectors,
+        vectors,
+        min(top_k, n - 1 if exclude_self else n),
+        memory_budget_mb,
+        adjust=exclude_diagonal if exclude_self else None,
+    )
 
 
 # def get_logger(name: str) -> logging.Logger: